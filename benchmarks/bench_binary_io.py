@@ -0,0 +1,61 @@
+"""
+Cost of getting a batch of 28x28 images into a tensor and the outputs back
+out: JSON number lists (json + torch.tensor / .tolist()) against the
+binary path of /run_binary and /predict_binary (decode_tensor /
+encode_tensor), plus single-image round trips through the app.
+
+    python benchmarks/bench_binary_io.py [batch_size]
+"""
+import io
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import server  # noqa: E402
+
+
+def timeit(fn, repeat=20):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    batch_size = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+    images = np.random.rand(batch_size, 1, 28, 28).astype(np.float32)
+    logits = torch.randn(batch_size, 10)
+
+    json_body = json.dumps({"images": images.tolist()}).encode()
+    raw_body = images.tobytes()
+    npy = io.BytesIO()
+    np.save(npy, images)
+    npy_body = npy.getvalue()
+
+    print(f"batch {batch_size}: JSON {len(json_body) / 1e6:.1f} MB, raw {len(raw_body) / 1e6:.1f} MB")
+    print(f"decode JSON:  {timeit(lambda: torch.tensor(json.loads(json_body)['images'])):8.2f} ms")
+    print(f"decode raw:   {timeit(lambda: server.decode_tensor(raw_body, {'x-shape': f'{batch_size},1,28,28'})):8.2f} ms")
+    print(f"decode npy:   {timeit(lambda: server.decode_tensor(npy_body, {'content-type': server.NPY_MEDIA_TYPE})):8.2f} ms")
+    print(f"encode JSON:  {timeit(lambda: json.dumps(logits.tolist())):8.2f} ms")
+    print(f"encode raw:   {timeit(lambda: server.encode_tensor(logits, {})):8.2f} ms")
+
+    model = nn.Sequential(nn.Flatten(), nn.Linear(784, 10)).eval()
+    server.model_store.add(server.ModelSession("bench", model, None, []))
+    client = TestClient(server.app)
+    image = images[:1]
+    single_json = {"image": image.ravel().tolist(), "model_id": "bench"}
+    single_raw = image.tobytes()
+    print(f"/predict:        {timeit(lambda: client.post('/predict', json=single_json), 200):6.2f} ms/request")
+    print(f"/predict_binary: {timeit(lambda: client.post('/predict_binary?model_id=bench', content=single_raw), 200):6.2f} ms/request")
+
+
+if __name__ == "__main__":
+    main()
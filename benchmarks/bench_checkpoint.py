@@ -0,0 +1,89 @@
+"""
+Loading a saved block graph: building the layers and copying a
+torch.load'ed state_dict into them (every process holds its own copy of
+the weights) against load_checkpoint, which maps the .safetensors file.
+Each variant runs in a fresh process and reports load time, the first
+forward pass, and how the resident set splits into private (RssAnon) and
+page-cache-backed, shareable (RssFile) memory. Linux only.
+
+    python benchmarks/bench_checkpoint.py [hidden] [layers]
+"""
+import os
+import subprocess
+import sys
+import tempfile
+
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import server  # noqa: E402
+
+CHILD = """
+import os, sys, time, warnings
+warnings.simplefilter("ignore")
+sys.path.insert(0, {repo!r})
+sys.path.insert(0, {bench_dir!r})
+os.environ["BLOCKBUILD_MODEL_DIR"] = {model_dir!r}
+import torch
+import server
+from bench_checkpoint import linear_graph
+
+def rss():
+    fields = dict(line.split(":") for line in open("/proc/self/status"))
+    return [int(fields[k].split()[0]) / 1024 for k in ("RssAnon", "RssFile")]
+
+anon0, file0 = rss()
+start = time.perf_counter()
+if {mode!r} == "torch.load":
+    sorted_graph = linear_graph({hidden}, {layers})
+    model = server.CompiledGraph(sorted_graph.nodes, sorted_graph.incoming).eval()
+    model.load_state_dict(torch.load({pickle!r}))
+    session = server.ModelSession("bench", model, sorted_graph, [])
+else:
+    session = server.load_checkpoint("bench")
+loaded = time.perf_counter() - start
+start = time.perf_counter()
+with torch.inference_mode():
+    session.forward(torch.randn(1, {hidden}))
+first = time.perf_counter() - start
+anon1, file1 = rss()
+print(f"{{loaded * 1000:.1f}} {{first * 1000:.1f}} {{anon1 - anon0:.0f}} {{file1 - file0:.0f}}")
+"""
+
+
+def linear_graph(hidden, layers):
+    nodes = []
+    for i in range(layers):
+        nodes.append(server.NodeData(id=f"l{i}", type="linear", inFeatures=hidden, outFeatures=hidden))
+        nodes.append(server.NodeData(id=f"r{i}", type="relu"))
+    incoming = {n.id: [] for n in nodes}
+    for a, b in zip(nodes, nodes[1:]):
+        incoming[b.id].append(a.id)
+    return server.SortedGraph(nodes, incoming)
+
+
+def main():
+    hidden = int(sys.argv[1]) if len(sys.argv) > 1 else 2048
+    layers = int(sys.argv[2]) if len(sys.argv) > 2 else 12
+    repo = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+    with tempfile.TemporaryDirectory() as model_dir:
+        server.MODEL_DIR = server.Path(model_dir)
+        sorted_graph = linear_graph(hidden, layers)
+        model = server.CompiledGraph(sorted_graph.nodes, sorted_graph.incoming).eval()
+        path, nbytes = server.save_checkpoint(server.ModelSession("bench", model, sorted_graph, []))
+        pickle = os.path.join(model_dir, "bench.pt")
+        torch.save(model.state_dict(), pickle)
+        print(f"{layers} x Linear({hidden}, {hidden}): {nbytes / 2**20:.0f} MB checkpoint")
+        print(f"{'':12s} {'load':>9s} {'1st fwd':>9s} {'RssAnon':>9s} {'RssFile':>9s}")
+
+        for mode in ("torch.load", "mmap"):
+            code = CHILD.format(repo=repo, bench_dir=os.path.dirname(os.path.abspath(__file__)),
+                                model_dir=model_dir, mode=mode, pickle=pickle, hidden=hidden, layers=layers)
+            out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+            loaded, first, anon, file = out.split()
+            print(f"{mode:12s} {loaded:>6s} ms {first:>6s} ms {anon:>6s} MB {file:>6s} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+One pass over MNIST- and CIFAR-10-shaped training splits: the DataLoader
+path (PIL + ToTensor + Normalize per sample) against TensorBatchLoader
+over DecodedImages. Synthetic data is written to a temporary ./data so
+no download is needed.
+
+    python benchmarks/bench_dataset_epoch.py [num_samples]
+"""
+import os
+import struct
+import sys
+import tempfile
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+from torch.utils.data import DataLoader
+from torchvision import transforms
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import server  # noqa: E402
+
+
+def write_mnist(root, n):
+    raw = os.path.join(root, "data", "MNIST", "raw")
+    os.makedirs(raw)
+    rng = np.random.default_rng(0)
+    for prefix, count in (("train", n), ("t10k", n // 6)):
+        images = rng.integers(0, 256, size=(count, 28, 28), dtype=np.uint8)
+        labels = rng.integers(0, 10, size=count, dtype=np.uint8)
+        with open(os.path.join(raw, f"{prefix}-images-idx3-ubyte"), "wb") as f:
+            f.write(struct.pack(">IIII", 2051, count, 28, 28))
+            f.write(images.tobytes())
+        with open(os.path.join(raw, f"{prefix}-labels-idx1-ubyte"), "wb") as f:
+            f.write(struct.pack(">II", 2049, count))
+            f.write(labels.tobytes())
+
+
+class CifarShaped(torch.utils.data.Dataset):
+    # Same storage and __getitem__ as torchvision's CIFAR10.
+    def __init__(self, n, transform=None):
+        rng = np.random.default_rng(0)
+        self.data = rng.integers(0, 256, size=(n, 32, 32, 3), dtype=np.uint8)
+        self.targets = rng.integers(0, 10, size=n).tolist()
+        self.transform = transform
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, index):
+        img = Image.fromarray(self.data[index])
+        return self.transform(img), self.targets[index]
+
+
+def epoch_seconds(loader):
+    start = time.perf_counter()
+    count = 0
+    for images, labels in loader:
+        count += images.size(0)
+    return time.perf_counter() - start, count
+
+
+def report(name, slow_loader, fast_loader):
+    slow, n = epoch_seconds(slow_loader)
+    fast, _ = epoch_seconds(fast_loader)
+    print(f"{name:>8} {n:>7} {slow:>12.2f} {fast:>12.3f} {slow / fast:>8.0f}x")
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 60_000
+    torch.set_num_threads(1)
+    print(f"{'dataset':>8} {'samples':>7} {'DataLoader s':>12} {'tensor s':>12} {'speedup':>9}")
+
+    with tempfile.TemporaryDirectory() as root:
+        write_mnist(root, n)
+        os.chdir(root)
+        slow, _ = server.load_dataset("mnist", 64, fast=False)
+        fast, _ = server.load_dataset("mnist", 64, fast=True)
+        report("mnist", slow, fast)
+
+    transform = transforms.Compose([
+        transforms.ToTensor(),
+        transforms.Normalize(*server.CIFAR_NORMALIZE),
+    ])
+    cifar = CifarShaped(min(n, 50_000), transform)
+    decoded = server.DecodedImages.from_torchvision(cifar, server.CIFAR_NORMALIZE)
+    report(
+        "cifar10",
+        DataLoader(cifar, batch_size=64, shuffle=True),
+        server.TensorBatchLoader(decoded, batch_size=64, shuffle=True),
+    )
+
+
+if __name__ == "__main__":
+    main()
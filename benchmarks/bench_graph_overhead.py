@@ -0,0 +1,94 @@
+"""
+Per-batch overhead of executing a block graph: the old per-node interpreter
+(string dispatch + edge scan on every forward) against CompiledGraph.
+
+    python benchmarks/bench_graph_overhead.py
+"""
+import os
+import sys
+import time
+
+import torch
+import torch.nn as nn
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import server  # noqa: E402
+
+
+def make_graph(num_nodes, width=8):
+    nodes, edges = [], []
+    for i in range(num_nodes):
+        t = "linear" if i % 2 == 0 else "relu"
+        nodes.append(server.NodeData(id=f"n{i}", type=t, inFeatures=width, outFeatures=width))
+        if i:
+            edges.append(server.EdgeData(source=f"n{i - 1}", target=f"n{i}"))
+    layers = {
+        n.id: nn.Linear(width, width) if n.type == "linear" else nn.ReLU()
+        for n in nodes
+    }
+    return nodes, edges, layers
+
+
+def legacy_forward(sorted_nodes, edges, layers, z):
+    # The dispatch loop forward_once used before graphs were compiled.
+    node_outputs = {}
+    for node in sorted_nodes:
+        t = node.type.lower()
+        incoming = []
+        for e in edges:
+            if e.target == node.id:
+                if e.source not in node_outputs:
+                    raise RuntimeError("Edge error")
+                incoming.append(node_outputs[e.source])
+
+        if not incoming:
+            current = z
+        elif t == "concat":
+            current = torch.cat(incoming, dim=1)
+        else:
+            current = incoming[0].clone()
+
+        layer = layers[node.id]
+        if t in ["conv2d", "convtranspose2d", "maxpool2d", "avgpool2d", "adaptiveavgpool2d"]:
+            current = layer(current)
+        elif t in ["conv1d", "convtranspose1d", "maxpool1d", "avgpool1d", "adaptiveavgpool1d"]:
+            current = layer(current)
+        elif t in ["linear", "layernorm"]:
+            if current.dim() == 4:
+                current = current.view(current.size(0), -1)
+            current = layer(current)
+        elif t in ["relu", "dropout", "softmax"]:
+            current = layer(current)
+        else:
+            raise ValueError(f"Unknown node type {node.type}")
+        node_outputs[node.id] = current
+    return node_outputs[sorted_nodes[-1].id]
+
+
+def per_batch_us(fn, z, repeats):
+    with torch.no_grad():
+        for _ in range(10):
+            fn(z)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            fn(z)
+    return (time.perf_counter() - start) / repeats * 1e6
+
+
+def main():
+    torch.set_num_threads(1)
+    z = torch.randn(64, 8)
+    print(f"{'nodes':>6} {'legacy us/batch':>16} {'compiled us/batch':>18} {'speedup':>8}")
+    for num_nodes in (10, 200):
+        nodes, edges, layers = make_graph(num_nodes)
+        sorted_nodes, incoming = server.topological_sort(nodes, edges)
+        compiled = server.CompiledGraph(sorted_nodes, incoming, layers)
+        repeats = 2000 if num_nodes <= 10 else 100
+
+        legacy = per_batch_us(lambda x: legacy_forward(sorted_nodes, edges, layers, x), z, repeats)
+        fast = per_batch_us(compiled, z, repeats)
+        print(f"{num_nodes:>6} {legacy:>16.1f} {fast:>18.1f} {legacy / fast:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
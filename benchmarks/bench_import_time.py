@@ -0,0 +1,73 @@
+"""
+Cold-start profile of server.py: a `python -X importtime` summary of the
+modules it pulls in directly, and the wall time from process start to the
+first /run response (what a fresh serverless instance pays).
+
+    python benchmarks/bench_import_time.py [repo_dir] [runs]
+
+repo_dir defaults to this checkout; point it at another worktree to
+compare revisions.
+"""
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+FIRST_RESPONSE = """
+import sys, time, warnings
+warnings.simplefilter("ignore")
+sys.path.insert(0, {repo!r})
+import server
+from fastapi.testclient import TestClient
+TestClient(server.app).post("/run", json={{"input": [1.0, 2.0]}})
+print(time.time())
+"""
+
+
+def import_profile(repo):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import server"],
+        cwd=repo, capture_output=True, text=True, check=True,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((depth, name.strip(), int(cumulative)))
+    total = next(c for d, n, c in rows if n == "server")
+    # server is at depth 0; what it imports itself sits one level down.
+    direct = sorted(((c, n) for d, n, c in rows if d == 1), reverse=True)
+    return total, direct
+
+
+def first_response(repo):
+    start = time.time()
+    out = subprocess.run(
+        [sys.executable, "-c", FIRST_RESPONSE.format(repo=repo)],
+        cwd=repo, capture_output=True, text=True, check=True,
+    ).stdout
+    return float(out.strip().splitlines()[-1]) - start
+
+
+def main():
+    repo = os.path.abspath(sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(__file__), ".."))
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    totals, direct = [], None
+    for _ in range(runs):
+        total, direct = import_profile(repo)
+        totals.append(total)
+    print(f"import server: {statistics.median(totals) / 1e6:.2f} s (median of {runs})")
+    print("largest direct imports (last run):")
+    for cumulative, name in direct[:10]:
+        print(f"  {cumulative / 1e6:7.3f} s  {name}")
+
+    times = [first_response(repo) for _ in range(runs)]
+    print(f"process start -> first /run response: {statistics.median(times):.2f} s (median of {runs})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Images/sec of the Tiny ImageNet DataLoader path (JPEG decode + RandomCrop
++ RandomHorizontalFlip per sample) for different worker counts, on a
+synthetic Tiny ImageNet-shaped folder of 64x64 JPEGs.
+
+    python benchmarks/bench_loader_workers.py [images] [workers ...]
+"""
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import server  # noqa: E402
+
+
+def write_fixture(root, num_images, num_classes=20):
+    rng = np.random.default_rng(0)
+    train = os.path.join(root, "data", "tiny-imagenet-200", "train")
+    for i in range(num_images):
+        wnid = f"n{i % num_classes:08d}"
+        folder = os.path.join(train, wnid, "images")
+        os.makedirs(folder, exist_ok=True)
+        pixels = rng.integers(0, 256, size=(64, 64, 3), dtype=np.uint8)
+        Image.fromarray(pixels).save(os.path.join(folder, f"{wnid}_{i}.JPEG"), quality=90)
+
+
+def images_per_second(config, batch_size=128):
+    server.dataset_cache.clear()
+    train_loader, _ = server.load_dataset("tinyimagenet", batch_size, loader=config)
+    it = iter(train_loader)
+    next(it)  # exclude worker start-up
+    start = time.perf_counter()
+    count = 0
+    for images, _ in it:
+        count += images.size(0)
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    num_images = int(sys.argv[1]) if len(sys.argv) > 1 else 5_000
+    worker_counts = [int(w) for w in sys.argv[2:]] or [0, 1, 2, 4, 8]
+
+    print(f"cpus available: {server.available_cpus()}, default workers: {server.loader_config().num_workers}")
+    with tempfile.TemporaryDirectory() as root:
+        write_fixture(root, num_images)
+        os.chdir(root)
+        print(f"{'workers':>7} {'images/s':>10}")
+        for workers in worker_counts:
+            config = server.LoaderConfig(
+                num_workers=workers,
+                prefetch_factor=4 if workers else None,
+                persistent_workers=bool(workers),
+            )
+            print(f"{workers:>7} {images_per_second(config):>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Requests/sec of /loss_plot: rendering a fresh pyplot figure per request
+(the old handler) against the cached PNG, SVG and downsampled JSON
+responses and a conditional request answered with 304.
+
+    python benchmarks/bench_loss_plot.py [history_length]
+"""
+import io
+import os
+import sys
+import time
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt  # noqa: E402
+import numpy as np  # noqa: E402
+import torch.nn as nn  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import server  # noqa: E402
+
+
+def legacy_render(loss_history):
+    buf = io.BytesIO()
+    plt.figure()
+    plt.plot(loss_history)
+    plt.xlabel("Epoch")
+    plt.ylabel("Loss")
+    plt.title("BlockBuild - Loss History")
+    plt.savefig(buf, format="png")
+    plt.close()
+    return buf.getvalue()
+
+
+def rate(fn, seconds=2.0):
+    fn()
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        fn()
+        count += 1
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    length = int(sys.argv[1]) if len(sys.argv) > 1 else 5_000
+    history = (np.exp(-np.linspace(0, 5, length)) + 0.01 * np.random.rand(length)).tolist()
+    server.model_store.add(server.ModelSession("bench", nn.Linear(1, 1), None, history))
+    client = TestClient(server.app)
+
+    def get(fmt, **headers):
+        return lambda: client.get("/loss_plot", params={"model_id": "bench", "format": fmt}, headers=headers)
+
+    etag = client.get("/loss_plot", params={"model_id": "bench"}).headers["etag"]
+    print(f"loss history of {length} epochs")
+    print(f"render per request (old)   {rate(lambda: legacy_render(history)):8.1f} req/s")
+    print(f"cached png                 {rate(get('png')):8.1f} req/s")
+    print(f"cached svg                 {rate(get('svg')):8.1f} req/s")
+    print(f"cached json                {rate(get('json')):8.1f} req/s")
+    print(f"If-None-Match -> 304       {rate(get('png', **{'If-None-Match': etag})):8.1f} req/s")
+    print(f"plot cache: {server.plot_cache.stats()}")
+
+
+if __name__ == "__main__":
+    main()
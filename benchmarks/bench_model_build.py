@@ -0,0 +1,105 @@
+"""
+Model build time for large graphs: layers from the old per-node if/elif
+chain handed to CompiledGraph, against CompiledGraph building them through
+BLOCK_TYPES. Also times the output_shapes() pre-flight check, and splits
+what a submitted graph costs into sorting, building fresh layers, and the
+graph_fingerprint() a cache lookup would need first.
+
+    python benchmarks/bench_model_build.py
+"""
+import os
+import sys
+import time
+
+import torch.nn as nn
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import server  # noqa: E402
+
+# Order of the branches in the old builder; each node paid one string
+# comparison per branch until it matched.
+LEGACY_ORDER = [
+    "linear", "relu", "dropout", "layernorm", "convtranspose1d", "convtranspose2d",
+    "convtranspose3d", "conv1d", "conv2d", "conv3d", "maxpool1d", "maxpool2d",
+    "maxpool3d", "avgpool1d", "avgpool2d", "avgpool3d", "adaptiveavgpool1d",
+    "adaptiveavgpool2d", "embedding", "concat", "softmax", "matmul", "scale",
+    "mask", "batchnorm", "ui",
+]
+
+CYCLE = ["linear", "batchnorm", "relu", "dropout", "layernorm", "scale", "softmax"]
+
+
+def make_graph(num_nodes, width=16):
+    nodes, edges = [], []
+    for i in range(num_nodes):
+        t = CYCLE[i % len(CYCLE)]
+        nodes.append(server.NodeData(
+            id=f"n{i}", type=t, inFeatures=width, outFeatures=width,
+            numFeatures=width, mode="1d",
+        ))
+        if i:
+            edges.append(server.EdgeData(source=f"n{i - 1}", target=f"n{i}"))
+    return nodes, edges
+
+
+def legacy_build(sorted_nodes):
+    layers = {}
+    for node in sorted_nodes:
+        t = node.type.lower()
+        for name in LEGACY_ORDER:
+            if t == name:
+                break
+        if t == "linear":
+            layers[node.id] = nn.Linear(node.inFeatures, node.outFeatures)
+        elif t == "relu":
+            layers[node.id] = nn.ReLU()
+        elif t == "dropout":
+            layers[node.id] = nn.Dropout(0.5 if node.p is None else float(node.p))
+        elif t == "layernorm":
+            layers[node.id] = nn.LayerNorm(node.normalizedShape or node.inFeatures)
+        elif t == "softmax":
+            layers[node.id] = nn.Softmax(dim=-1)
+        elif t == "scale":
+            layers[node.id] = None
+        elif t == "batchnorm":
+            layers[node.id] = nn.BatchNorm1d(node.numFeatures)
+    return layers
+
+
+def best_of(fn, repeats=5):
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    print(f"{'nodes':>6} {'if/elif ms':>11} {'registry ms':>12} {'shape check ms':>15}")
+    for num_nodes in (50, 500, 2000):
+        nodes, edges = make_graph(num_nodes)
+        sorted_graph = server.topological_sort(nodes, edges)
+
+        legacy = best_of(lambda: server.CompiledGraph(
+            sorted_graph.nodes, sorted_graph.incoming, legacy_build(sorted_graph.nodes)))
+        fast = best_of(lambda: server.CompiledGraph(sorted_graph.nodes, sorted_graph.incoming))
+        model = server.CompiledGraph(sorted_graph.nodes, sorted_graph.incoming)
+        shapes = best_of(lambda: model.output_shapes((64, 16)))
+        print(f"{num_nodes:>6} {legacy:>11.1f} {fast:>12.1f} {shapes:>15.2f}")
+
+    print()
+    print(f"{'nodes':>6} {'sort ms':>8} {'build ms':>9} {'fingerprint ms':>15}")
+    for num_nodes in (50, 500, 2000):
+        nodes, edges = make_graph(num_nodes)
+        graph = server.GraphRequest(nodes=nodes, edges=edges)
+        sorted_graph = server.topological_sort(nodes, edges)
+
+        sort = best_of(lambda: server.topological_sort(graph.nodes, graph.edges))
+        build = best_of(lambda: server.CompiledGraph(sorted_graph.nodes, sorted_graph.incoming))
+        fingerprint = best_of(lambda: server.graph_fingerprint(graph))
+        print(f"{num_nodes:>6} {sort:>8.2f} {build:>9.1f} {fingerprint:>15.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Training steps/sec of a CIFAR-10-shaped conv graph under each execution
+mode of CompiledGraph.set_execution: fp32 / bf16 autocast, with and
+without channels_last. bf16 gains need a CPU with native bf16 support
+(AVX512-BF16 or AMX); elsewhere autocast mostly adds conversion cost.
+
+    python benchmarks/bench_precision.py [batch_size] [steps]
+"""
+import os
+import sys
+import time
+
+import torch
+import torch.nn as nn
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import server  # noqa: E402
+
+
+def make_graph():
+    specs = [
+        dict(type="conv2d", inChannels=3, outChannels=32, kernelH=3, kernelW=3, padH=1, padW=1),
+        dict(type="batchnorm", mode="2d", numFeatures=32),
+        dict(type="relu"),
+        dict(type="maxpool2d"),
+        dict(type="conv2d", inChannels=32, outChannels=64, kernelH=3, kernelW=3, padH=1, padW=1),
+        dict(type="batchnorm", mode="2d", numFeatures=64),
+        dict(type="relu"),
+        dict(type="maxpool2d"),
+        dict(type="linear", inFeatures=64 * 8 * 8, outFeatures=10),
+    ]
+    nodes = [server.NodeData(id=f"n{i}", **spec) for i, spec in enumerate(specs)]
+    edges = [server.EdgeData(source=f"n{i}", target=f"n{i + 1}") for i in range(len(nodes) - 1)]
+    return server.topological_sort(nodes, edges)
+
+
+def run(sorted_graph, precision, channels_last, batch_size, steps):
+    torch.manual_seed(0)
+    model = server.CompiledGraph(sorted_graph.nodes, sorted_graph.incoming)
+    model.set_execution(precision, channels_last)
+    optimizer = torch.optim.SGD(model.parameters(), lr=0.01)
+    criterion = nn.CrossEntropyLoss()
+    images = torch.randn(batch_size, 3, 32, 32)
+    labels = torch.randint(0, 10, (batch_size,))
+
+    def step():
+        loss = criterion(model(images), labels)
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+        return loss.detach()
+
+    for _ in range(3):
+        step()
+    start = time.perf_counter()
+    for _ in range(steps):
+        loss = step()
+    loss.item()
+    return steps / (time.perf_counter() - start)
+
+
+def main():
+    batch_size = int(sys.argv[1]) if len(sys.argv) > 1 else 128
+    steps = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    sorted_graph = make_graph()
+
+    print(f"batch {batch_size}, {torch.get_num_threads()} threads, native bf16: {torch.ops.mkldnn._is_mkldnn_bf16_supported()}")
+    base = None
+    for precision in ("fp32", "bf16"):
+        for channels_last in (False, True):
+            rate = run(sorted_graph, precision, channels_last, batch_size, steps)
+            base = base or rate
+            label = f"{precision}{' + channels_last' if channels_last else ''}"
+            print(f"{label:24s} {rate:8.1f} steps/s  {rate * batch_size:9.0f} img/s  x{rate / base:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+/predict throughput under many concurrent clients, with the micro-batcher
+effectively off (max_batch=1) and on, plus the same images through one
+/predict_batch call. Requests go through the ASGI app in-process.
+
+    python benchmarks/bench_predict_batching.py [concurrency] [requests]
+"""
+import asyncio
+import os
+import sys
+import time
+
+import httpx
+import numpy as np
+import torch
+import torch.nn as nn
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import server  # noqa: E402
+
+
+def make_model():
+    return nn.Sequential(
+        nn.Conv2d(1, 16, 3, padding=1), nn.ReLU(), nn.MaxPool2d(2),
+        nn.Conv2d(16, 32, 3, padding=1), nn.ReLU(), nn.MaxPool2d(2),
+        nn.Flatten(), nn.Linear(32 * 7 * 7, 10),
+    ).eval()
+
+
+async def run_clients(concurrency, requests, image):
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        body = {"image": image, "model_id": "bench"}
+        remaining = iter(range(requests))
+
+        async def worker():
+            for _ in remaining:
+                r = await client.post("/predict", json=body)
+                r.raise_for_status()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return requests / (time.perf_counter() - start)
+
+
+def main():
+    concurrency = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 1024
+    torch.set_num_threads(1)
+    server.model_store.add(server.ModelSession("bench", make_model(), None, []))
+    image = np.random.rand(784).tolist()
+
+    batcher = server.predict_batcher
+    print(f"{concurrency} concurrent clients, {requests} requests")
+    for max_batch, max_wait in ((1, 0.0), (32, 0.0), (32, 0.002)):
+        batcher.max_batch, batcher.max_wait = max_batch, max_wait
+        seen, batches = batcher.requests, batcher.batches
+        rate = asyncio.run(run_clients(concurrency, requests, image))
+        mean = (batcher.requests - seen) / (batcher.batches - batches)
+        print(f"/predict max_batch={max_batch:<3d} max_wait={max_wait * 1000:.0f}ms  {rate:8.0f} req/s  mean batch {mean:.1f}")
+
+    images = np.random.rand(requests, 784).astype(np.float32)
+    start = time.perf_counter()
+    asyncio.run(server.predict_batch({"images": images, "model_id": "bench"}))
+    print(f"predict_batch (no HTTP)                  {requests / (time.perf_counter() - start):8.0f} images/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+Tiny ImageNet epoch time: ImageFolder + per-image PIL transforms against
+the packed memory-mapped split with batched crop/flip. Uses a synthetic
+Tiny ImageNet-shaped folder.
+
+    python benchmarks/bench_tinyimagenet_memmap.py [images]
+"""
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "tools"))
+sys.path.insert(0, os.path.dirname(__file__))
+import server  # noqa: E402
+from bench_loader_workers import write_fixture  # noqa: E402
+from pack_tinyimagenet import pack  # noqa: E402
+
+
+def epoch_seconds(loader):
+    start = time.perf_counter()
+    for _ in loader:
+        pass
+    return time.perf_counter() - start
+
+
+def main():
+    num_images = int(sys.argv[1]) if len(sys.argv) > 1 else 5_000
+    with tempfile.TemporaryDirectory() as root:
+        write_fixture(root, num_images)
+        os.chdir(root)
+
+        folder_loader, _ = server.load_dataset("tinyimagenet", 128, loader=server.LoaderConfig())
+        folder = epoch_seconds(folder_loader)
+
+        start = time.perf_counter()
+        pack("./data/tiny-imagenet-200")
+        packing = time.perf_counter() - start
+
+        packed_loader, _ = server.load_dataset("tinyimagenet", 128)
+        assert isinstance(packed_loader.dataset, server.MemmapImages)
+        packed = epoch_seconds(packed_loader)
+
+    print(f"images: {num_images}")
+    print(f"ImageFolder epoch: {folder:.2f} s")
+    print(f"one-time pack:     {packing:.2f} s")
+    print(f"memmap epoch:      {packed:.3f} s ({folder / packed:.0f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+topological_sort on large synthetic graphs, against the old list.pop(0)
+implementation it replaced.
+
+    python benchmarks/bench_topological_sort.py
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import server  # noqa: E402
+
+
+def make_graph(num_nodes, layers, seed=0):
+    # Layered random DAG: each node reads from two nodes of the previous
+    # layer. Few layers means a wide ready queue, many layers a deep one.
+    rng = random.Random(seed)
+    width = max(1, num_nodes // layers)
+    nodes = [server.NodeData(id=f"n{i}", type="relu") for i in range(num_nodes)]
+    edges = []
+    for i in range(width, num_nodes):
+        start = (i // width - 1) * width
+        for src in rng.sample(range(start, start + width), min(width, 2)):
+            edges.append(server.EdgeData(source=f"n{src}", target=f"n{i}"))
+    rng.shuffle(nodes)
+    return nodes, edges
+
+
+def legacy_sort(nodes, edges):
+    node_map = {n.id: n for n in nodes}
+    graph = {n.id: [] for n in nodes}
+    indegree = {n.id: 0 for n in nodes}
+    for e in edges:
+        if e.source in graph and e.target in graph:
+            graph[e.source].append(e.target)
+            indegree[e.target] += 1
+    queue = [nid for nid in graph if indegree[nid] == 0]
+    result = []
+    while queue:
+        nid = queue.pop(0)
+        result.append(node_map[nid])
+        for neighbor in graph[nid]:
+            indegree[neighbor] -= 1
+            if indegree[neighbor] == 0:
+                queue.append(neighbor)
+    return result
+
+
+def best_of(fn, repeats=3):
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    print(f"{'nodes':>7} {'shape':>6} {'legacy ms':>10} {'deque ms':>9}")
+    for num_nodes in (1_000, 5_000, 20_000, 50_000):
+        for shape, layers in (("wide", 4), ("deep", num_nodes // 4)):
+            nodes, edges = make_graph(num_nodes, layers)
+            legacy = best_of(lambda: legacy_sort(nodes, edges))
+            fast = best_of(lambda: server.topological_sort(nodes, edges))
+            print(f"{num_nodes:>7} {shape:>6} {legacy:>10.1f} {fast:>9.1f}")
+
+    nodes, edges = make_graph(1_000, 100)
+    edges.append(server.EdgeData(source="n999", target="n10"))
+    try:
+        server.topological_sort(nodes, edges)
+    except server.GraphCycleError as e:
+        print(f"cycle report for 1000-node graph: {len(e.cycle_nodes)} nodes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Training steps/sec with a host read-back (.item()) of loss and correct
+count on every batch, against accumulating both as tensors and reading
+them once per epoch, as run_train_dataset now does. On CPU the saving is
+the per-call overhead; on an accelerator each .item() is a full sync.
+
+    python benchmarks/bench_train_step_sync.py [device]
+"""
+import sys
+import time
+
+import torch
+import torch.nn as nn
+
+
+def make_model(device):
+    return nn.Sequential(nn.Flatten(), nn.Linear(784, 32), nn.ReLU(), nn.Linear(32, 10)).to(device)
+
+
+def run(device, batches, per_batch_sync, track_accuracy=True):
+    model = make_model(device)
+    optimizer = torch.optim.SGD(model.parameters(), lr=0.01)
+    criterion = nn.CrossEntropyLoss()
+    images = torch.randn(batches, 64, 1, 28, 28, device=device)
+    labels = torch.randint(0, 10, (batches, 64), device=device)
+
+    loss_sum = torch.zeros((), device=device)
+    correct = torch.zeros((), dtype=torch.long, device=device)
+    loss_f, correct_i = 0.0, 0
+
+    start = time.perf_counter()
+    for i in range(batches):
+        outputs = model(images[i])
+        loss = criterion(outputs, labels[i])
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+        if per_batch_sync:
+            loss_f += loss.item()
+            correct_i += (outputs.argmax(dim=1) == labels[i]).sum().item()
+        else:
+            loss_sum += loss.detach()
+            if track_accuracy:
+                correct += (outputs.detach().argmax(dim=1) == labels[i]).sum()
+    if not per_batch_sync:
+        loss_f, correct_i = loss_sum.item(), correct.item()
+    if device.startswith("cuda"):
+        torch.cuda.synchronize()
+    return batches / (time.perf_counter() - start)
+
+
+def main():
+    device = sys.argv[1] if len(sys.argv) > 1 else "cpu"
+    torch.set_num_threads(1)
+    batches = 938  # one MNIST epoch at batch size 64
+    run(device, 50, True)
+
+    print(f"device: {device}")
+    print(f"per-batch .item():           {run(device, batches, True):8.0f} steps/s")
+    print(f"tensor accumulation:         {run(device, batches, False):8.0f} steps/s")
+    print(f"accumulation, no train acc:  {run(device, batches, False, False):8.0f} steps/s")
+
+
+if __name__ == "__main__":
+    main()
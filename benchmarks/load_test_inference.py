@@ -0,0 +1,107 @@
+"""
+Load test: /predict latency from concurrent clients against a real uvicorn
+server, first idle and then while a multi-epoch /train_dataset job runs.
+Inference has its own executor; with more than one CPU, dataset training
+runs on the process pool with its own torch thread budget by default
+(BLOCKBUILD_TRAIN_PROCESSES=0 trains in-process, sharing the server's).
+
+Synthetic MNIST is written to a temporary ./data, no download needed.
+
+    python benchmarks/load_test_inference.py [clients] [seconds]
+"""
+import asyncio
+import multiprocessing
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+import numpy as np
+import uvicorn
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import server  # noqa: E402
+from bench_dataset_epoch import write_mnist  # noqa: E402
+
+
+def conv_graph(channels):
+    nodes = [
+        dict(id="c1", type="conv2d", inChannels=1, outChannels=channels, kernelH=3, kernelW=3, padH=1, padW=1),
+        dict(id="r1", type="relu"),
+        dict(id="p1", type="maxpool2d"),
+        dict(id="l1", type="linear", inFeatures=channels * 14 * 14, outFeatures=10),
+    ]
+    edges = [dict(source=a["id"], target=b["id"]) for a, b in zip(nodes, nodes[1:])]
+    return {"nodes": nodes, "edges": edges, "inputSource": "dataset", "datasetName": "mnist"}
+
+
+def start_server():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    config = uvicorn.Config(server.app, host="127.0.0.1", port=port, log_level="warning")
+    uv = uvicorn.Server(config)
+    threading.Thread(target=uv.run, daemon=True).start()
+    while not uv.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}"
+
+
+async def measure(base_url, model_id, clients, seconds):
+    image = np.random.rand(784).tolist()
+    latencies = []
+    deadline = time.monotonic() + seconds
+
+    async def client(http):
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            r = await http.post("/predict", json={"image": image, "model_id": model_id})
+            r.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as http:
+        await asyncio.gather(*(client(http) for _ in range(clients)))
+    ms = np.array(latencies) * 1000
+    return len(ms) / seconds, np.percentile(ms, 50), np.percentile(ms, 99)
+
+
+def report(label, result):
+    rate, p50, p99 = result
+    print(f"{label:18s} {rate:7.0f} req/s   p50 {p50:7.2f} ms   p99 {p99:7.2f} ms")
+
+
+def main():
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    with tempfile.TemporaryDirectory() as root:
+        write_mnist(root, 12_000)
+        os.chdir(root)
+        base_url = start_server()
+        print(f"cpus {server.available_cpus()}, server threads {server.SERVER_THREADS}, "
+              f"train processes {server.TRAIN_PROCESSES} x {server.TRAIN_THREADS} threads")
+
+        with httpx.Client(base_url=base_url, timeout=600) as http:
+            model = http.post("/train_dataset", json={**conv_graph(8), "epochs": 1}).json()
+            model_id = model["model_id"]
+
+            report("idle", asyncio.run(measure(base_url, model_id, clients, seconds)))
+
+            job = http.post("/jobs", json={**conv_graph(32), "epochs": 50}).json()
+            while http.get(f"/jobs/{job['job_id']}").json()["status"] != "running":
+                time.sleep(0.05)
+            report("during training", asyncio.run(measure(base_url, model_id, clients, seconds)))
+            status = http.get(f"/jobs/{job['job_id']}").json()
+            print(f"training job still {status['status']}, progress {status['progress']}", flush=True)
+    # The training job is still running on a daemon worker; don't wait for
+    # it, and stop the training process running it along with this one.
+    for child in multiprocessing.active_children():
+        child.terminate()
+    os._exit(0)
+
+
+if __name__ == "__main__":
+    main()
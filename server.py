@@ -1,11 +1,27 @@
-from fastapi import FastAPI, WebSocket
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request, Response
 import asyncio
 from pydantic import BaseModel
-from typing import List, Optional, Literal, Dict
+from typing import List, Optional, Literal, Dict, NamedTuple, Callable
+from collections import deque, OrderedDict
+import copy
+import hashlib
+import json
+import mmap
+import re
+import struct
+import threading
+import queue
+import itertools
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+import time
+import uuid
+import warnings
 
 import torch
 import torch.nn as nn
+import torch.multiprocessing as torch_mp
 import math
+from functools import partial
 from fastapi.middleware.cors import CORSMiddleware
 
 import torch
@@ -13,17 +29,13 @@ import numpy as np
 
 
 import os
+from pathlib import Path
 from torch.utils.data import DataLoader
-from torchvision import datasets, transforms
-from torchvision.datasets import ImageFolder
-
 
-import matplotlib
-matplotlib.use("Agg") 
+# torchvision and matplotlib are imported where they are used: together
+# they are about half of the import time, and most requests (/run,
+# /predict, cached plots) never touch them.
 import io
-from fastapi.responses import StreamingResponse
-
-import matplotlib.pyplot as plt
 
 
 
@@ -41,9 +53,9 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Shape", "X-Dtype"],
 )
 
-model = None
 class NodeData(BaseModel):
     id: str
     type: Optional[str] = None  # "linear", "relu", "dropout", "layernorm", "conv", "maxpool"
@@ -120,8 +132,23 @@ class GraphRequest(BaseModel):
     #noiseLevel: Optional[float] = 0.0
     #datasetName: str
     datasetName: Optional[str] = None
+    model_id: Optional[str] = None
+    priority: Optional[int] = 0
+    numWorkers: Optional[int] = None
+    prefetchFactor: Optional[int] = None
+    persistentWorkers: Optional[bool] = None
+    dropLast: Optional[bool] = None
+    logInterval: Optional[int] = None
+    trainAccuracy: Optional[bool] = True
+    precision: Optional[Literal["fp32", "bf16"]] = "fp32"
+    channelsLast: Optional[bool] = False
+    backend: Optional[Literal["eager", "trace", "compile"]] = None
+    evalSamples: Optional[int] = None
+    evalFraction: Optional[float] = None
+    asyncEval: Optional[bool] = False
     class Config:
         extra = "allow"
+        protected_namespaces = ()
 
 class RunRequest(BaseModel):
     input: dict
@@ -133,44 +160,245 @@ class TestConfig(BaseModel):
     noise_level: float = 0.0
     max_samples: int = 20
     datasetName: Optional[Literal["mnist", "fashion", "cifar10", "cifar100", "tinyimagenet"]] =  "mnist"
+    model_id: Optional[str] = None
+    eval_batch_size: Optional[int] = None
+    limit: Optional[int] = None
+    class Config:
+        protected_namespaces = ()
 
-plot_loss_history = []
+def downsample(values, max_points):
+    """Up to max_points evenly spaced (index, value) pairs, first and last included."""
+    n = len(values)
+    if n <= max_points:
+        return list(range(n)), list(values)
+    index = np.unique(np.linspace(0, n - 1, max(max_points, 2)).round().astype(int)).tolist()
+    return index, [values[i] for i in index]
 
 
-@app.get("/loss_plot")
-def get_loss_plot():
+def render_loss_png(loss_history):
+    # Figure instead of pyplot: no global figure state, safe across threads.
+    from matplotlib.figure import Figure
+
+    fig = Figure()
+    ax = fig.subplots()
+    ax.plot([l if l is not None else float("nan") for l in loss_history])
+    ax.set_xlabel("Epoch")
+    ax.set_ylabel("Loss")
+    ax.set_title("BlockBuild - Loss History")
 
     buf = io.BytesIO()
+    fig.savefig(buf, format = "png")
+    return buf.getvalue()
+
+
+def render_loss_svg(loss_history, max_points=500, width=640, height=480):
+    """Hand-written SVG polyline; skips non-finite (None) losses."""
+    index, values = downsample(loss_history, max_points)
+    left, right, top, bottom = 60, 20, 40, 50
+    finite = [v for v in values if v is not None]
+    lo, hi = (min(finite), max(finite)) if finite else (0.0, 1.0)
+    if hi == lo:
+        hi = lo + 1.0
+    last = max(len(loss_history) - 1, 1)
+
+    def x(i):
+        return left + (width - left - right) * i / last
+
+    def y(v):
+        return height - bottom - (height - top - bottom) * (v - lo) / (hi - lo)
+
+    segments, current = [], []
+    for i, v in zip(index, values):
+        if v is None:
+            if current:
+                segments.append(current)
+            current = []
+        else:
+            current.append(f"{x(i):.1f},{y(v):.1f}")
+    if current:
+        segments.append(current)
+
+    lines = "".join(
+        f'<polyline fill="none" stroke="#1f77b4" stroke-width="1.5" points="{" ".join(points)}"/>'
+        for points in segments
+    )
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" viewBox="0 0 {width} {height}" font-family="sans-serif" font-size="12">'
+        f'<rect width="{width}" height="{height}" fill="white"/>'
+        f'<path d="M{left},{top}V{height - bottom}H{width - right}" fill="none" stroke="black"/>'
+        f'{lines}'
+        f'<text x="{width / 2}" y="24" text-anchor="middle" font-size="14">BlockBuild - Loss History</text>'
+        f'<text x="{width / 2}" y="{height - 12}" text-anchor="middle">Epoch</text>'
+        f'<text x="16" y="{height / 2}" text-anchor="middle" transform="rotate(-90 16 {height / 2})">Loss</text>'
+        f'<text x="{left - 4}" y="{top + 4}" text-anchor="end">{hi:.4g}</text>'
+        f'<text x="{left - 4}" y="{height - bottom + 4}" text-anchor="end">{lo:.4g}</text>'
+        f'<text x="{width - right}" y="{height - bottom + 16}" text-anchor="end">{len(loss_history)}</text>'
+        f'</svg>'
+    ).encode()
+
+
+class LRUCache:
+    """
+    Thread-safe least recently used cache with hit and miss counters.
+    Oldest entries are dropped once there are more than max_size of them,
+    or once their total weight(value) exceeds max_weight; the newest entry
+    is always kept.
+    """
+
+    def __init__(self, max_size=None, max_weight=None, weight=None):
+        self.max_size = max_size
+        self.max_weight = max_weight
+        self.weight = weight
+        self.entries = OrderedDict()
+        self.total_weight = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        weight = self.weight(value) if self.weight is not None else 0
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.total_weight -= old[1]
+            self.entries[key] = (value, weight)
+            self.total_weight += weight
+            while len(self.entries) > 1 and (
+                (self.max_size is not None and len(self.entries) > self.max_size)
+                or (self.max_weight is not None and self.total_weight > self.max_weight)
+            ):
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.total_weight -= evicted
+
+    def get_or_create(self, key, factory):
+        value = self.get(key)
+        if value is None:
+            value = factory()
+            self.put(key, value)
+        return value
+
+    def values(self):
+        with self.lock:
+            return [value for value, _ in self.entries.values()]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_weight = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+# Rendered loss plots. Keys carry the model session's version, which
+# changes only when a model is (re)trained, so a cached plot is never
+# stale and is reused until evicted.
+plot_cache = LRUCache(int(os.environ.get("BLOCKBUILD_PLOT_CACHE_SIZE", 64)))
+
+PLOT_MEDIA_TYPES = {"png": "image/png", "svg": "image/svg+xml", "json": "application/json"}
+
+
+@app.get("/loss_plot")
+def get_loss_plot(
+    request: Request,
+    model_id: Optional[str] = None,
+    format: Literal["png", "svg", "json"] = "png",
+    points: int = 500,
+):
+    session = model_store.get(model_id)
+    loss_history = session.loss_history if session is not None else []
+    version = (session.model_id, session.version) if session is not None else (None, 0)
+
+    etag = '"{}-{}-{}-{}"'.format(*version, format, points)
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    def render():
+        if format == "png":
+            return render_loss_png(loss_history)
+        if format == "svg":
+            return render_loss_svg(loss_history, points)
+        index, values = downsample(loss_history, points)
+        return json.dumps({"epochs": index, "loss": values, "total": len(loss_history)}).encode()
+
+    content = plot_cache.get_or_create(version + (format, points), render)
+    return Response(content, media_type=PLOT_MEDIA_TYPES[format], headers={"ETag": etag})
+
+
+@app.get("/stats")
+def get_stats():
+    return {
+        "backends": backend_cache.stats(),
+        "models": model_store.stats(),
+        "jobs": training_jobs.stats(),
+        "short_jobs": short_jobs.stats(),
+        "datasets": dataset_cache.stats(),
+        "predict": predict_batcher.stats(),
+        "plots": plot_cache.stats(),
+        "threads": {
+            "server": SERVER_THREADS,
+            "train_processes": TRAIN_PROCESSES,
+            "train_process_threads": TRAIN_THREADS,
+        },
+    }
 
-    plt.figure()
-    plt.plot(plot_loss_history)
-    plt.xlabel("Epoch")
-    plt.ylabel("Loss")
-    plt.title("BlockBuild - Loss History")
 
-    plt.savefig(buf, format = "png")
-    plt.close()
+class GraphCycleError(ValueError):
+    def __init__(self, cycle_nodes):
+        self.cycle_nodes = cycle_nodes
+        super().__init__(
+            "Graph contains a cycle through: " + ", ".join(cycle_nodes)
+        )
 
-    buf.seek(0)
 
-    return StreamingResponse(buf, media_type="image/png")
+class SortedGraph(NamedTuple):
+    nodes: list
+    incoming: dict
 
 
 def topological_sort(nodes, edges):
+    """
+    Kahn's algorithm over a deque. Ready nodes come out in the order they
+    were submitted, so the same graph always sorts the same way.
+    """
     node_map = {n.id: n for n in nodes}
-    graph = {n.id: [] for n in nodes}
-    indegree = {n.id: 0 for n in nodes}
+    if len(node_map) != len(nodes):
+        raise ValueError("Graph contains duplicate node ids")
 
-    for e in edges:
-        if e.source in graph and e.target in graph:
-            graph[e.source].append(e.target)
-            indegree[e.target] += 1
+    graph = {nid: [] for nid in node_map}
+    indegree = dict.fromkeys(node_map, 0)
+    incoming = {nid: [] for nid in node_map}
 
-    queue = [nid for nid in graph if indegree[nid] == 0]
+    for e in edges:
+        source, target = e.source, e.target
+        for end, nid in (("source", source), ("target", target)):
+            if nid not in graph:
+                raise ValueError(f"Edge error: '{source}' -> '{target}' but {end} is not in the graph")
+        graph[source].append(target)
+        indegree[target] += 1
+        incoming[target].append(source)
+
+    queue = deque(nid for nid in graph if indegree[nid] == 0)
     result = []
 
     while queue:
-        nid = queue.pop(0)
+        nid = queue.popleft()
         result.append(node_map[nid])
         for neighbor in graph[nid]:
             indegree[neighbor] -= 1
@@ -178,136 +406,560 @@ def topological_sort(nodes, edges):
                 queue.append(neighbor)
 
     if len(result) != len(nodes):
-        raise ValueError("Graph contains a cycle or invalid connections")
+        raise GraphCycleError(_find_cycle_nodes(graph, indegree))
+
+    return SortedGraph(result, incoming)
+
+
+def _find_cycle_nodes(graph, indegree):
+    # Nodes left over by Kahn's algorithm are either on a cycle or
+    # downstream of one. Tarjan's strongly connected components over them
+    # (iterative, so long chains do not hit the recursion limit): a node is
+    # on a cycle exactly when its component has more than one node or it
+    # has an edge to itself.
+    remaining = {nid for nid, d in indegree.items() if d > 0}
+    index = {}
+    lowlink = {}
+    stack = []
+    on_stack = set()
+    on_cycle = set()
+
+    for root in remaining:
+        if root in index:
+            continue
+        work = [(root, iter(graph[root]))]
+        index[root] = lowlink[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        while work:
+            nid, neighbors = work[-1]
+            for neighbor in neighbors:
+                if neighbor not in remaining:
+                    continue
+                if neighbor == nid:
+                    on_cycle.add(nid)
+                elif neighbor not in index:
+                    index[neighbor] = lowlink[neighbor] = len(index)
+                    stack.append(neighbor)
+                    on_stack.add(neighbor)
+                    work.append((neighbor, iter(graph[neighbor])))
+                    break
+                elif neighbor in on_stack:
+                    lowlink[nid] = min(lowlink[nid], index[neighbor])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[nid])
+                if lowlink[nid] == index[nid]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == nid:
+                            break
+                    if len(component) > 1:
+                        on_cycle.update(component)
+
+    return [nid for nid in graph if nid in on_cycle]
+
+
+
+
+MNIST_NORMALIZE = ((0.1307,), (0.3081,))
+CIFAR_NORMALIZE = ((0.4914, 0.4822, 0.4465), (0.2023, 0.1994, 0.2010))
+IMAGENET_NORMALIZE = ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225))
+
+# torchvision.datasets class names, resolved on first use.
+DATASETS = {
+    "mnist": ("MNIST", MNIST_NORMALIZE),
+    "fashion": ("FashionMNIST", MNIST_NORMALIZE),
+    "cifar10": ("CIFAR10", CIFAR_NORMALIZE),
+    "cifar100": ("CIFAR100", CIFAR_NORMALIZE),
+}
+
+
+def _dataset_nbytes(ds):
+    data = getattr(ds, "data", None)
+    if isinstance(data, np.memmap):
+        # Backed by the page cache, not by this process.
+        return 0
+    if isinstance(data, torch.Tensor):
+        return data.numel() * data.element_size()
+    if isinstance(data, np.ndarray):
+        return data.nbytes
+    # ImageFolder and friends only hold file paths.
+    return len(getattr(ds, "samples", ())) * 256
+
+
+class DatasetCache(LRUCache):
+    """
+    Process-wide cache of decoded datasets keyed by (dataset, split,
+    transform). Least recently used entries are dropped once the
+    resident data exceeds max_bytes.
+    """
 
-    return result
+    def __init__(self, max_bytes=2 << 30):
+        super().__init__(max_weight=max_bytes, weight=_dataset_nbytes)
+        self.key_locks = {}
 
+    def get_or_create(self, key, factory):
+        with self.lock:
+            key_lock = self.key_locks.setdefault(key, threading.Lock())
 
-def get_inputs_for_nodes(node_id, edges, node_outputs):
-    inputs = []
-    for e in edges:
-        if e.target == node_id:
-            if e.source not in node_outputs:
-                raise RuntimeError(
-                    f"Edge error: '{e.source}' -> '{node_id}'"
-                    f"but source is not computed yet"
-                )
-            inputs.append(node_outputs[e.source])
-    
-    return inputs
+        # One loader per key; other keys keep being served meanwhile.
+        with key_lock:
+            return super().get_or_create(key, factory)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": [list(k) for k in self.entries],
+                "bytes": self.total_weight,
+                "max_bytes": self.max_weight,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+dataset_cache = DatasetCache(int(os.environ.get("BLOCKBUILD_DATASET_CACHE_BYTES", 2 << 30)))
+
+
+def _open_torchvision_dataset(class_name, train, transform):
+    from torchvision import datasets
+
+    dataset_class = getattr(datasets, class_name)
+    # Only fall back to the download path when the files are not on disk.
+    try:
+        return dataset_class(root="./data", train=train, download=False, transform=transform)
+    except RuntimeError:
+        return dataset_class(root="./data", train=train, download=True, transform=transform)
 
-graph_nodes = []
-graph_edges = []
-sorted_nodes=[]
-layers={}
 
+TINY_IMAGENET_ROOT = "./data/tiny-imagenet-200"
 
-def load_dataset(dataset_name: str, batch_size=64):
+
+class TinyImageNetVal(torch.utils.data.Dataset):
     """
-    transform = transforms.Compose([
-        transforms.ToTensor(),
-        transforms.Normalize((0.1307,),(0.3081,))
-    ])
+    Tiny ImageNet val/: one flat images/ folder labelled by
+    val_annotations.txt, with the class indices of the train/ ImageFolder.
     """
 
-    DATASETS = {
-        "mnist": (
-            datasets.MNIST,
-            transforms.Compose([
-                transforms.ToTensor(),
-                transforms.Normalize((0.1307,),(0.3081,))
-            ])
-        ),
-        "fashion":(
-            datasets.FashionMNIST,
-            transforms.Compose([
-                transforms.ToTensor(),
-                transforms.Normalize((0.1307,),(0.3081,))
-            ])
-        ),
-        "cifar10":(
-            datasets.CIFAR10,
-            transforms.Compose([
+    split = "val"
+
+    def __init__(self, root, transform=None):
+        from torchvision.datasets.folder import default_loader, find_classes
+
+        self.classes, self.class_to_idx = find_classes(os.path.join(root, "train"))
+        self.samples = []
+        with open(os.path.join(root, "val", "val_annotations.txt")) as f:
+            for line in f:
+                name, wnid = line.split("\t")[:2]
+                self.samples.append((os.path.join(root, "val", "images", name), self.class_to_idx[wnid]))
+        self.targets = [target for _, target in self.samples]
+        self.transform = transform
+        self.loader = default_loader
+
+    def __len__(self):
+        return len(self.samples)
+
+    def __getitem__(self, index):
+        path, target = self.samples[index]
+        image = self.loader(path)
+        if self.transform is not None:
+            image = self.transform(image)
+        return image, target
+
+
+def _open_tinyimagenet(split, transform):
+    from torchvision.datasets import ImageFolder
+
+    if split != "train" and os.path.exists(os.path.join(TINY_IMAGENET_ROOT, "val", "val_annotations.txt")):
+        return TinyImageNetVal(TINY_IMAGENET_ROOT, transform)
+    # Without val/ the only labelled images are the training ones.
+    ds = ImageFolder(root=os.path.join(TINY_IMAGENET_ROOT, "train"), transform=transform)
+    ds.split = "train"
+    return ds
+
+
+def get_dataset(dataset_name: str, split: str):
+    from torchvision import transforms
+
+    if dataset_name == "tinyimagenet":
+        if split == "train":
+            key, transform = "augment", transforms.Compose([
+                transforms.RandomCrop(64, padding = 4),
+                transforms.RandomHorizontalFlip(),
                 transforms.ToTensor(),
-                transforms.Normalize(
-                    (0.4914, 0.4822, 0.4465),
-                    (0.2023, 0.1994, 0.2010))
+                transforms.Normalize(*IMAGENET_NORMALIZE)
             ])
-        ),
-        "cifar100":(
-            datasets.CIFAR100,
-            transforms.Compose([
+        else:
+            key, transform = "normalize", transforms.Compose([
+                transforms.Resize(64),
                 transforms.ToTensor(),
-                transforms.Normalize(
-                    (0.4914, 0.4822, 0.4465),
-                    (0.2023, 0.1994, 0.2010))
+                transforms.Normalize(*IMAGENET_NORMALIZE)
             ])
-        ),
-    }
+        return dataset_cache.get_or_create(
+            (dataset_name, split, key),
+            lambda: _open_tinyimagenet(split, transform)
+        )
 
-    #Tiny IMAGENET dataset
-    if dataset_name == "tinyimagenet":
-        transform_train = transforms.Compose([
-            transforms.RandomCrop(64, padding = 4),
-            transforms.RandomHorizontalFlip(),
-            transforms.ToTensor(),
-            transforms.Normalize(
-                (0.485, 0.456, 0.406),
-                (0.229, 0.224, 0.225)
-            )
-        ])
-
-        transform_test = transforms.Compose([
-            transforms.Resize(64),
-            transforms.ToTensor(),
-            transforms.Normalize(
-                (0.485, 0.456, 0.406),
-                (0.229, 0.224, 0.225)
-            )
-        ])
+    if dataset_name not in DATASETS:
+        raise ValueError(f"Unknown dataset: {dataset_name}")
+
+    class_name, normalize = DATASETS[dataset_name]
+    transform = transforms.Compose([
+        transforms.ToTensor(),
+        transforms.Normalize(*normalize)
+    ])
+    return dataset_cache.get_or_create(
+        (dataset_name, split, "normalize"),
+        lambda: _open_torchvision_dataset(class_name, split == "train", transform)
+    )
+
+
+class DecodedImages(torch.utils.data.Dataset):
+    """
+    A whole split decoded once into a contiguous uint8 [N, C, H, W] tensor.
+    Normalisation is applied per batch, giving the same values as
+    ToTensor() + Normalize() without going through PIL per sample.
+    """
+
+    def __init__(self, data, targets, mean, std, classes=None):
+        self.data = data
+        self.targets = targets
+        self.mean = torch.tensor(mean).view(1, -1, 1, 1)
+        self.std = torch.tensor(std).view(1, -1, 1, 1)
+        self.classes = classes
+
+    @classmethod
+    def from_torchvision(cls, ds, normalize):
+        data = ds.data
+        if isinstance(data, np.ndarray):
+            # CIFAR keeps HWC numpy arrays
+            data = torch.from_numpy(data).permute(0, 3, 1, 2).contiguous()
+        else:
+            data = data.unsqueeze(1)
+        targets = torch.as_tensor(ds.targets, dtype=torch.long)
+        return cls(data, targets, *normalize, classes=getattr(ds, "classes", None))
+
+    def share_memory(self):
+        """Move the arrays to shared memory so training processes map them instead of copying."""
+        self.data.share_memory_()
+        self.targets.share_memory_()
+        return self
 
-        train_ds = ImageFolder(
-            root = "./data/tiny-imagenet-200/train",
-            transform = transform_train
+    def normalize(self, images):
+        return images.float().div_(255).sub_(self.mean).div_(self.std)
+
+    def get_batch(self, index):
+        return self.normalize(self.data[index]), self.targets[index]
+
+    def __len__(self):
+        return self.data.size(0)
+
+    def __getitem__(self, index):
+        return self.normalize(self.data[index:index + 1])[0], int(self.targets[index])
+
+
+class TensorBatchLoader:
+    """
+    DataLoader stand-in for DecodedImages and MemmapImages: batches are
+    cut from the stored array by index slicing, shuffled with one
+    permutation per epoch. `indices` restricts iteration to a subset.
+    """
+
+    def __init__(self, dataset, batch_size=64, shuffle=False, indices=None):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.indices = indices
+
+    def __len__(self):
+        n = len(self.dataset) if self.indices is None else len(self.indices)
+        return math.ceil(n / self.batch_size)
+
+    def __iter__(self):
+        ds = self.dataset
+        n = len(ds) if self.indices is None else len(self.indices)
+        order = torch.randperm(n) if self.shuffle else None
+        if self.indices is not None:
+            order = self.indices if order is None else self.indices[order]
+        for start in range(0, n, self.batch_size):
+            if order is None:
+                index = slice(start, start + self.batch_size)
+            else:
+                index = order[start:start + self.batch_size]
+            yield ds.get_batch(index)
+
+
+class MemmapImages(torch.utils.data.Dataset):
+    """
+    A split packed by tools/pack_tinyimagenet.py: uint8 [N, H, W, C] images
+    in a memory-mapped .npy file plus a labels array. Pages come from the OS
+    cache, so every worker and process shares one copy. With augment=True
+    each batch gets RandomCrop(padding) + RandomHorizontalFlip on the uint8
+    tensor instead of per-image PIL calls.
+    """
+
+    def __init__(self, images_path, labels_path, mean, std, classes=None, augment=False, padding=4, split=None):
+        self.split = split
+        self.data = np.load(images_path, mmap_mode="r")
+        self.targets = torch.from_numpy(np.load(labels_path)).long()
+        self.mean = torch.tensor(mean).view(1, -1, 1, 1)
+        self.std = torch.tensor(std).view(1, -1, 1, 1)
+        self.classes = classes
+        self.augment = augment
+        self.padding = padding
+
+    def _crop_flip(self, images):
+        """[B, H, W, C] uint8 -> randomly cropped and flipped [B, C, H, W]."""
+        b, h, w, _ = images.shape
+        p = self.padding
+        padded = torch.nn.functional.pad(images.permute(0, 3, 1, 2), (p, p, p, p))
+        # Every crop window of both the batch and its mirror image, as views:
+        # [2, B, C, 2p+1, 2p+1, H, W]. Picking one window per image is a
+        # single gather over the batch.
+        windows = torch.stack([padded, padded.flip(-1)]).unfold(3, h, 1).unfold(4, w, 1)
+        flip = torch.rand(b) < 0.5
+        tops = torch.randint(0, 2 * p + 1, (b,))
+        lefts = torch.randint(0, 2 * p + 1, (b,))
+        # Crop at `left`, then flip == the mirror's window at 2p - left.
+        lefts = torch.where(flip, 2 * p - lefts, lefts)
+        return windows[flip.long(), torch.arange(b), :, tops, lefts].contiguous()
+
+    def get_batch(self, index):
+        if isinstance(index, torch.Tensor):
+            # Sorted reads keep page faults sequential within a batch.
+            index = torch.sort(index).values
+            # Fancy indexing already copies out of the memmap.
+            images = torch.from_numpy(self.data[index.numpy()])
+        else:
+            images = torch.from_numpy(np.array(self.data[index]))
+        if self.augment:
+            images = self._crop_flip(images)
+        else:
+            images = images.permute(0, 3, 1, 2).contiguous()
+        images = images.float().div_(255).sub_(self.mean).div_(self.std)
+        return images, self.targets[index]
+
+    def __len__(self):
+        return len(self.targets)
+
+    def __getitem__(self, index):
+        images, labels = self.get_batch(slice(index, index + 1))
+        return images[0], int(labels[0])
+
+    def __getstate__(self):
+        # Pickled by path: another process maps the same file.
+        state = self.__dict__.copy()
+        state["data"] = self.data.filename
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.data = np.load(self.data, mmap_mode="r")
+
+
+def get_decoded_dataset(dataset_name: str, split: str):
+    class_name, normalize = DATASETS[dataset_name]
+    return dataset_cache.get_or_create(
+        (dataset_name, split, "uint8"),
+        lambda: DecodedImages.from_torchvision(
+            _open_torchvision_dataset(class_name, split == "train", None), normalize
         )
+    )
+
+
+TINY_IMAGENET_PACKED = os.path.join(TINY_IMAGENET_ROOT, "packed")
+
+
+def get_packed_tinyimagenet(split: str):
+    root = TINY_IMAGENET_PACKED
+    if not os.path.exists(os.path.join(root, "train_images.npy")):
+        return None
+
+    name = "train" if split == "train" else "val"
+    if not os.path.exists(os.path.join(root, f"{name}_images.npy")):
+        # No packed val split: the ImageFolder path reads val/ directly.
+        return None
 
-        test_ds = ImageFolder(
-            root = "./data/tiny-imagenet-200/train",
-            transform = transform_test
+    def load():
+        with open(os.path.join(root, "classes.json")) as f:
+            classes = json.load(f)
+        return MemmapImages(
+            os.path.join(root, f"{name}_images.npy"),
+            os.path.join(root, f"{name}_labels.npy"),
+            *IMAGENET_NORMALIZE,
+            classes=classes,
+            augment=split == "train",
+            split=name,
         )
 
-        train_loader = DataLoader(train_ds, batch_size=batch_size, shuffle=True)
-        test_loader = DataLoader(test_ds, batch_size=batch_size, shuffle=False)
+    return dataset_cache.get_or_create(("tinyimagenet", split, "memmap"), load)
 
-        return train_loader, test_loader
 
+def get_fast_dataset(dataset_name: str, split: str):
+    if dataset_name in DATASETS:
+        return get_decoded_dataset(dataset_name, split)
+    if dataset_name == "tinyimagenet":
+        return get_packed_tinyimagenet(split)
+    return None
 
 
-    if dataset_name not in DATASETS:
-        raise ValueError(f"Unknown dataset: {dataset_name}")
-    
-    dataset_class, transform = DATASETS[dataset_name]
+FAST_DATASETS = os.environ.get("BLOCKBUILD_FAST_DATASETS", "1") != "0"
+
+
+class LoaderConfig(NamedTuple):
+    num_workers: int = 0
+    prefetch_factor: Optional[int] = None
+    persistent_workers: bool = False
+    drop_last: bool = False
+
+
+def available_cpus():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
 
-    train_ds = dataset_class(
-        root = "./data",
-        train = True,
-        download = True,
-        transform = transform
+def loader_config(graph=None):
+    """
+    DataLoader settings for the decoding (non-tensor) path: per-request
+    values from the GraphRequest, then BLOCKBUILD_LOADER_* variables, then
+    a worker count sized from the CPUs this process may use.
+    """
+    def pick(field, env, default, cast):
+        value = getattr(graph, field, None) if graph is not None else None
+        if value is not None:
+            return value
+        if env in os.environ:
+            return cast(os.environ[env])
+        return default
+
+    workers = pick("numWorkers", "BLOCKBUILD_LOADER_WORKERS", min(8, available_cpus() - 1), int)
+    workers = max(0, workers)
+    return LoaderConfig(
+        num_workers=workers,
+        prefetch_factor=pick("prefetchFactor", "BLOCKBUILD_LOADER_PREFETCH", 4, int) if workers else None,
+        persistent_workers=bool(workers) and pick("persistentWorkers", "BLOCKBUILD_LOADER_PERSISTENT", True, lambda v: v != "0"),
+        drop_last=pick("dropLast", "BLOCKBUILD_LOADER_DROP_LAST", False, lambda v: v != "0"),
     )
-    
-    test_ds = dataset_class(
-        root = "./data",
-        train = False,
-        download = True,
-        transform = transform
+
+
+def make_loader(ds, batch_size, shuffle, config):
+    sampler = torch.utils.data.RandomSampler(ds) if shuffle else torch.utils.data.SequentialSampler(ds)
+    return DataLoader(
+        ds,
+        batch_sampler=torch.utils.data.BatchSampler(sampler, batch_size, drop_last=config.drop_last and shuffle),
+        num_workers=config.num_workers,
+        prefetch_factor=config.prefetch_factor,
+        persistent_workers=config.persistent_workers,
+        pin_memory=torch.cuda.is_available(),
     )
 
-    train_loader = DataLoader(train_ds, batch_size=batch_size, shuffle=True)
-    test_loader = DataLoader(test_ds, batch_size=batch_size, shuffle=False)
 
+def load_split(dataset_name: str, split: str, batch_size=64, shuffle=False, fast=FAST_DATASETS, loader=None):
+    ds = get_fast_dataset(dataset_name, split) if fast else None
+    if ds is not None:
+        return TensorBatchLoader(ds, batch_size=batch_size, shuffle=shuffle)
+
+    config = loader if loader is not None else loader_config()
+    return make_loader(get_dataset(dataset_name, split), batch_size, shuffle, config)
+
+
+def load_dataset(dataset_name: str, batch_size=64, fast=FAST_DATASETS, loader=None, eval_batch_size=None):
+    train_loader = load_split(dataset_name, "train", batch_size, True, fast, loader)
+    test_loader = load_split(dataset_name, "test", eval_batch_size or batch_size, False, fast, loader)
 
     return train_loader, test_loader
 
+
+EVAL_BATCH_SIZE = int(os.environ.get("BLOCKBUILD_EVAL_BATCH_SIZE", 1000))
+# Held-out samples evaluated by default when a dataset's "test" split is
+# really its training images (Tiny ImageNet without val/).
+TRAIN_SPLIT_EVAL_SAMPLES = int(os.environ.get("BLOCKBUILD_TRAIN_SPLIT_EVAL_SAMPLES", 10_000))
+
+def eval_indices(targets, samples=None, fraction=None, seed=0):
+    """
+    Stratified subsample of a dataset for evaluation: each class keeps its
+    share of `samples` (or `fraction` of the set), rounded by largest
+    remainder so exactly that many are returned. Classes whose share
+    rounds down to nothing get their one example first. Returns None when
+    the whole set should be evaluated.
+    """
+    targets = torch.as_tensor(targets, dtype=torch.long)
+    n = targets.numel()
+    if samples is None and fraction is not None:
+        samples = round(n * fraction)
+    if samples is None or samples >= n:
+        return None
+
+    generator = torch.Generator().manual_seed(seed)
+    perm = torch.randperm(n, generator=generator)
+    # Stable sort by class keeps the random order within each class.
+    grouped = perm[torch.sort(targets[perm], stable=True).indices]
+    classes = targets[grouped]
+    counts = torch.bincount(classes)
+    starts = torch.cumsum(counts, 0) - counts
+    rank = torch.arange(n) - starts[classes]
+    exact = counts.double() * max(samples, 1) / n
+    quota = exact.floor().long()
+    # Flooring leaves fewer than one example per class to hand out.
+    short = max(samples, 1) - int(quota.sum())
+    priority = ((quota == 0) & (counts > 0)).double() + (exact - quota)
+    quota[torch.sort(priority, descending=True, stable=True).indices[:short]] += 1
+    return torch.sort(grouped[rank < quota[classes]]).values
+
+
+def subset_loader(loader, indices, config):
+    """Sequential loader over `indices` of the loader's dataset, same batch size."""
+    if indices is None:
+        return loader
+    if isinstance(loader, TensorBatchLoader):
+        return TensorBatchLoader(loader.dataset, loader.batch_size, shuffle=False, indices=indices)
+    subset = torch.utils.data.Subset(loader.dataset, indices.tolist())
+    return make_loader(subset, loader.batch_sampler.batch_size, False, config)
+
+
+def dataset_label_map(dataset_name, ds):
+    if dataset_name == "tinyimagenet":
+        return get_tinyimagenet_maps()
+    return getattr(ds, "classes", None)
+
+
+def evaluate(forward, loader, label_map=None, max_samples=20):
+    """
+    Accuracy of `forward` over `loader`, plus up to max_samples misclassified
+    examples and the evaluation throughput.
+    """
+    correct = torch.zeros((), dtype=torch.long)
+    total = 0
+    samples = []
+    start = time.perf_counter()
+
+    with torch.inference_mode():
+        for x, y in loader:
+            out = forward(x)
+            preds = torch.argmax(out, dim = 1)
+            correct += (preds == y).sum()
+            total += y.size(0)
+            samples += collect_misclassified(out, preds, y, max_samples - len(samples), label_map)
+
+    correct = int(correct)
+    seconds = time.perf_counter() - start
+    return {
+        "accuracy": correct / total if total > 0 else 0.0,
+        "correct": correct,
+        "total": total,
+        "samples": samples,
+        "seconds": seconds,
+        "samples_per_sec": total / seconds if seconds > 0 else None,
+    }
+
+
 def add_noise(x, noise_level):
     if noise_level == 0:
         return x
@@ -315,6 +967,26 @@ def add_noise(x, noise_level):
     x = x + noise
     return torch.clamp(x, 0., 1.)
 
+def collect_misclassified(out, preds, y, limit, label_map=None):
+    """Up to `limit` misclassified rows of a batch, as response samples."""
+    if limit <= 0:
+        return []
+    wrong = (preds != y).nonzero(as_tuple=True)[0][:limit]
+    if wrong.numel() == 0:
+        return []
+
+    trues = y[wrong].tolist()
+    predicted = preds[wrong].tolist()
+    outputs = out[wrong].tolist()
+    if label_map is not None:
+        trues = [label_map[t] for t in trues]
+        predicted = [label_map[p] for p in predicted]
+
+    return [
+        {"true": t, "pred": p, "output": o}
+        for t, p, o in zip(trues, predicted, outputs)
+    ]
+
 def get_label_map(dataset_name: str):
 
     if dataset_name == "fashion":
@@ -359,622 +1031,1456 @@ def get_tinyimagenet_maps():
     return idx_to_name
 
 
-def forward_once(z):
-        
-        global sorted_nodes
-        
-        #print("SORTED:", sorted_nodes)
-        node_outputs = {}
+def _flatten(current):
+    if current.dim() == 4:
+        # reshape, not view: channels_last activations are not contiguous.
+        current = current.reshape(current.size(0), -1)
+    return current
 
-        for node in sorted_nodes:
-            t = node.type.lower()
-            incoming = get_inputs_for_nodes(node.id, graph_edges, node_outputs)
 
-            if not incoming:
-                current = z
-            elif t == "concat":
-                current = torch.cat(incoming, dim=1)
-            else:
-                current = incoming[0].clone()
+def _flat_shape(shape):
+    if len(shape) == 4:
+        return (shape[0], shape[1] * shape[2] * shape[3])
+    return shape
 
-            layer = layers[node.id]
 
-            if t in ["conv2d", "convtranspose2d", "maxpool2d", "avgpool2d", "adaptiveavgpool2d"]:
-                if current.dim() != 4:
-                    raise ValueError(f"{t} expects 4D input [B,C,H,W], got {current.shape}")
-                current = layer(current)
+def _conv_out(size, kernel, stride, padding):
+    out = (size + 2 * padding - kernel) // stride + 1
+    if out < 1:
+        raise ValueError(f"kernel {kernel} does not fit input size {size} (padding {padding})")
+    return out
 
-            elif t in ["conv1d", "convtranspose1d", "maxpool1d", "avgpool1d", "adaptiveavgpool1d"]:
-                if current.dim() == 4:
-                    current = current.reshape(current.size(0), -1)
-                if current.dim() == 2:
-                    current = current.unsqueeze(2)
-                elif current.dim() == 3 and current.shape[1] == 1:
-                    current = current.transpose(1, 2)
 
-                current = layer(current)
-            
-            elif t in ["linear", "layernorm"]:
-                if current.dim() == 4:
-                    current = current.view(current.size(0), -1)
-                #if current.dim() == 3 and t != "softmax":
-                #    current = current.squeeze(-1)
-                current = layer(current)
-
-            elif t in ["relu", "dropout", "softmax"]:
-                current = layer(current)
-
-            elif t == "embedding":
-                if current.dim() == 4:
-                    current = current.view(current.size(0), -1)
-                current = layer(current.long()).mean(dim=1)
-
-            elif t == "matmul":
-                if current.dim() == 4:
-                    current = current.view(current.size(0), -1)
-                a, b= incoming
-                current = torch.matmul(a, b.T)
-
-            elif t == "scale":
-                if current.dim() == 4:
-                    current = current.view(z.size(0), -1)
-                current = current / math.sqrt(current.shape[-1])
-
-            elif t == "mask":
-                if current.dim() == 4:
-                    current = current.view(current.size(0), -1)
-                scores = incoming[0]
-
-                T = scores.shape[-1]
-
-                mask = torch.triu(
-                    torch.ones(T, T, device=scores.device),
-                    diagonal=1
-                ) * (-1e9)
-  
-                current = scores + mask 
-            
-            elif t == "batchnorm":
-                mode = getattr(node, "mode", "1d")
+def _conv_transpose_out(size, kernel, stride, padding):
+    out = (size - 1) * stride - 2 * padding + kernel
+    if out < 1:
+        raise ValueError(f"transposed kernel {kernel} gives empty output for input size {size}")
+    return out
 
-                if mode == "1d":
-                    if current.dim() == 4:
-                        current = current.view(current.size(0), -1)
 
-                    if current.dim() == 2:
-                        current = layer(current)
-                    elif current.dim() == 3:
-                        current = layer(current)
+def _check_channels(node, shape, expected):
+    if expected is not None and shape[1] != expected:
+        raise ValueError(
+            f"{node.type} '{node.id}' expects {expected} input channels, got shape {list(shape)}"
+        )
 
-                elif mode == "2d":
-                    if current.dim() != 4:
-                        raise ValueError(f"BatchNorm2d expects 4D input, got {current.shape}")
 
-                    current = layer(current)
-            elif t == "ui":
-                continue
+# ---- layer constructors ----
 
-            else:
-                raise ValueError(f"Unknown node type {node.type}")
-            node_outputs[node.id] = current
+def _build_linear(node):
+    return nn.Linear(node.inFeatures, node.outFeatures)
 
-        return node_outputs[sorted_nodes[-1].id]
 
+def _build_relu(node):
+    return nn.ReLU()
 
-from pathlib import Path
-from fastapi.staticfiles import StaticFiles
-BASE_DIR = Path(__file__).resolve().parent
 
-app.mount("/public", StaticFiles(directory=BASE_DIR / "public"), name="public")
+def _build_dropout(node):
+    p = 0.5 if node.p is None else float(node.p)
+    return nn.Dropout(p)
 
-connections = {}
 
+def _build_layernorm(node):
+    return nn.LayerNorm(node.normalizedShape or node.inFeatures)
 
-@app.post("/train")
-def train_manual(graph: GraphRequest):
-    global layers, sorted_nodes, graph_nodes, graph_edges
-    global plot_loss_history 
-    graph_nodes = graph.nodes
-    graph_edges = graph.edges
 
-    samples = graph.training
-    num_epochs = graph.epochs or 20
-    lr = graph.learningRate or 0.01
+def _build_conv1d(node):
+    return nn.Conv1d(
+        node.inChannels, node.outChannels,
+        kernel_size=node.kernelSize or 3,
+        stride=node.stride or 1,
+        padding=node.padding or 0
+    )
 
-    def extract_tensor(d):
-        return torch.tensor(d["data"], dtype=torch.float32).view(1,-1)
-    
-    x = torch.cat([extract_tensor(s.input["data"]) for s in samples], dim=0)
-    y = torch.cat([extract_tensor(s.output["data"]) for s in samples], dim=0)
 
-    try: 
-        sorted_nodes=topological_sort(graph.nodes, graph.edges) 
-    except Exception as e:
-        return {"error": f"Topological sort failed: {e}"}
-    
+def _build_conv2d(node):
+    return nn.Conv2d(
+        node.inChannels, node.outChannels,
+        kernel_size=(node.kernelH or 3, node.kernelW or 3),
+        stride=(node.strideH or 1, node.strideW or 1),
+        padding=(node.padH or 0, node.padW or 0)
+    )
 
-    layers={}
-    for node in sorted_nodes:
-        t=node.type.lower()
-        if t == "linear":
-            layers[node.id] = nn.Linear(node.inFeatures, node.outFeatures)
-
-        elif t == "relu":
-            layers[node.id] = nn.ReLU()
-
-        elif t == "dropout":
-            p = 0.5 if node.p is None else float(node.p)
-            layers[node.id] = nn.Dropout(p)
-
-        elif t == "layernorm":
-            norm_shape = node.normalizedShape or node.inFeatures
-            layers[node.id] = nn.LayerNorm(norm_shape)
-
-        elif t == "convtranspose1d": # t == "convtranspose"
-                layers[node.id] = nn.ConvTranspose1d(
-                    node.inChannels, node.outChannels,
-                    kernel_size=node.kernelSize or 3,
-                    stride=node.stride or 1,
-                    padding=node.padding or 0
-                )
-        elif t == "convtranspose2d":
-                layers[node.id] = nn.ConvTranspose2d(
-                    node.inChannels, node.outChannels,
-                    kernel_size=(node.kernelH or 3, node.kernelW or 3),
-                    stride=(node.strideH or 1, node.strideW or 1),
-                    padding=(node.padH or 0, node.padW or 0)
-                )
-        elif t == "convtranspose3d":
-                layers[node.id] = nn.ConvTranspose3d(
-                    node.inChannels, node.outChannels,
-                    kernel_size=(node.kernelD or 3, node.kernelH or 3, node.kernelW or 3),
-                    stride=(node.strideD or 1, node.strideH or 1, node.strideW or 1),
-                    padding=(node.padD or 0, node.padH or 0, node.padW or 0)
-                )
 
-        elif t == "conv1d":
-                layers[node.id] = nn.Conv1d(
-                    node.inChannels, node.outChannels,
-                    kernel_size=node.kernelSize or 3,
-                    stride=node.stride or 1,
-                    padding=node.padding or 0
-                )
-        elif t == "conv2d":
-                layers[node.id] = nn.Conv2d(
-                    node.inChannels, node.outChannels,
-                    kernel_size=(node.kernelH or 3, node.kernelW or 3),
-                    stride=(node.strideH or 1, node.strideW or 1),
-                    padding=(node.padH or 0, node.padW or 0)
-                )
-        elif t == "conv3d":
-                layers[node.id] = nn.Conv3d(
-                    node.inChannels, node.outChannels,
-                    kernel_size=(node.kernelD or 3, node.kernelH or 3, node.kernelW or 3),
-                    stride=(node.strideD or 1, node.strideH or 1, node.strideW or 1),
-                    padding=(node.padD or 0, node.padH or 0, node.padW or 0)
-                )
+def _build_conv3d(node):
+    return nn.Conv3d(
+        node.inChannels, node.outChannels,
+        kernel_size=(node.kernelD or 3, node.kernelH or 3, node.kernelW or 3),
+        stride=(node.strideD or 1, node.strideH or 1, node.strideW or 1),
+        padding=(node.padD or 0, node.padH or 0, node.padW or 0)
+    )
 
-        elif t == "maxpool1d":
-            layers[node.id] = nn.MaxPool1d(node.kernel or 2, node.stride or 1)
 
-        elif t == "maxpool2d":
-            layers[node.id] = nn.MaxPool2d(
-                kernel_size=(node.kernelH or 2, node.kernelW or 2),
-                stride=(node.strideH or 2, node.strideW or 2)
-            )
+def _build_convtranspose1d(node):
+    return nn.ConvTranspose1d(
+        node.inChannels, node.outChannels,
+        kernel_size=node.kernelSize or 3,
+        stride=node.stride or 1,
+        padding=node.padding or 0
+    )
 
-        elif t == "maxpool3d":
-            layers[node.id] = nn.MaxPool3d(
-                kernel_size=(
-                    node.kernelD or 2,
-                    node.kernelH or 2,
-                    node.kernelW or 2,
-                ),
-                stride=(
-                    node.strideD or 2,
-                    node.strideH or 2,
-                    node.strideW or 2,
-                )
-            )
 
-        elif t == "avgpool1d":
-            layers[node.id] = nn.AvgPool1d(node.kernel or 2, node.stride or 1)
+def _build_convtranspose2d(node):
+    return nn.ConvTranspose2d(
+        node.inChannels, node.outChannels,
+        kernel_size=(node.kernelH or 3, node.kernelW or 3),
+        stride=(node.strideH or 1, node.strideW or 1),
+        padding=(node.padH or 0, node.padW or 0)
+    )
 
 
-        elif t == "avgpool2d":
-            layers[node.id] = nn.AvgPool2d(
-                kernel_size=(
-                    node.kernelH or 2,
-                    node.kernelW or 2,
-                ),
-                stride=(
-                    node.strideH or 2,
-                    node.strideW or 2,
-                )
-            )
+def _build_convtranspose3d(node):
+    return nn.ConvTranspose3d(
+        node.inChannels, node.outChannels,
+        kernel_size=(node.kernelD or 3, node.kernelH or 3, node.kernelW or 3),
+        stride=(node.strideD or 1, node.strideH or 1, node.strideW or 1),
+        padding=(node.padD or 0, node.padH or 0, node.padW or 0)
+    )
 
-        elif t == "avgpool3d":
-            layers[node.id] = nn.AvgPool3d(
-                kernel_size=(
-                    node.kernelD or 2,
-                    node.kernelH or 2,
-                    node.kernelW or 2,
-                ),
-                stride=(
-                    node.strideD or 2,
-                    node.strideH or 2,
-                    node.strideW or 2,
-                )
-            )
 
-        elif t =="adaptiveavgpool1d":
-                layers[node.id] = nn.AdaptiveAvgPool1d(node.outputSize or 1) 
+def _pool3d_args(node):
+    return dict(
+        kernel_size=(node.kernelD or 2, node.kernelH or 2, node.kernelW or 2),
+        stride=(node.strideD or 2, node.strideH or 2, node.strideW or 2),
+    )
 
-        elif t =="adaptiveavgpool2d":
-                layers[node.id] = nn.AdaptiveAvgPool2d(node.outputSize or 1) 
 
-        elif t == "embedding":
-            layers[node.id] = nn.Embedding(
-                node.numEmbeddings or 16,
-                node.embeddingDim or 16
-            )
+def _build_maxpool1d(node):
+    return nn.MaxPool1d(node.kernel or 2, node.stride or 1)
 
-        elif t == "concat":
-            layers[node.id] = None
-        
-        elif t == "softmax":
-            dim = node.softmaxDim if node.softmaxDim is not None else -1
-            layers[node.id] = nn.Softmax(dim = dim)
-
-        elif t == "matmul":
-            layers[node.id] = None
-        
-        elif t == "scale":
-            layers[node.id] = None
-
-        elif t == "mask":
-            layers[node.id] = None
-
-        elif t == "batchnorm":
-            mode = getattr(node, "mode", "1d")
-
-            if mode == "1d":
-                layers[node.id] = nn.BatchNorm1d(node.numFeatures)
-            elif mode == "2d":
-                layers[node.id] = nn.BatchNorm2d(node.numFeatures)
-            else:
-                raise ValueError(f"Unsupported BatchNorm mode: {mode}")
-            
-        elif t == "ui":
-            continue
-        
-    params = []
-    for m in layers.values():
-        if m is not None:
-            params += list(m.parameters())
 
-    #optimizer = torch.optim.SGD(params, lr=lr)
-    optimizer = torch.optim.Adam(params, lr=lr)
+def _build_maxpool2d(node):
+    return nn.MaxPool2d(
+        kernel_size=(node.kernelH or 2, node.kernelW or 2),
+        stride=(node.strideH or 2, node.strideW or 2)
+    )
 
 
-    loss_history = []
+def _build_maxpool3d(node):
+    return nn.MaxPool3d(**_pool3d_args(node))
 
-    clean_loss_history = []
 
-    for epochs in range(num_epochs):
-        optimizer.zero_grad()
-        z = forward_once(x)
+def _build_avgpool1d(node):
+    return nn.AvgPool1d(node.kernel or 2, node.stride or 1)
 
-        z = z.view(-1, 1)
-        y = y.view(-1, 1)
 
-        loss = torch.mean((z-y)*(z-y))
-        loss.backward()
-        optimizer.step()
-        loss_history.append(float(loss.item()))
+def _build_avgpool2d(node):
+    return nn.AvgPool2d(
+        kernel_size=(node.kernelH or 2, node.kernelW or 2),
+        stride=(node.strideH or 2, node.strideW or 2)
+    )
 
-    for layer in layers.values():
-        if layer is not None:
-            layer.eval()
 
-    with torch.no_grad():
-        out = forward_once(x)
+def _build_avgpool3d(node):
+    return nn.AvgPool3d(**_pool3d_args(node))
 
-    out = torch.nan_to_num(out, nan=0.0, posinf=1e6, neginf=-1e6)
 
-    for l in loss_history:
-        if math.isfinite(l):
-            clean_loss_history.append(l)
-        else:
-            clean_loss_history.append(None)
+def _build_adaptiveavgpool1d(node):
+    return nn.AdaptiveAvgPool1d(node.outputSize or 1)
 
-    
-    #plt.plot(clean_loss_history)
-    #plt.xlabel("Epoch")
-    #plt.ylabel("Loss")
-    #plt.title("BlockBuild – Loss History")
-    #plt.savefig("loss.png")
-    #plt.close()
 
-    plot_loss_history.clear()
-    plot_loss_history.extend(clean_loss_history)
+def _build_adaptiveavgpool2d(node):
+    return nn.AdaptiveAvgPool2d(node.outputSize or 1)
 
-    return {
-        "output": out.tolist(),
-        "loss": clean_loss_history[-1],
-        #"loss": loss,
-        #"loss_history": loss_history,
-        "loss_history": clean_loss_history,
-    }
 
-@app.post("/train_dataset")
-def train_dataset(graph: GraphRequest):
-    num_epochs = graph.epochs or 5
-    lr = graph.learningRate or 0.001
-    batch_size = graph.batchSize or 64
-    dataset_name = graph.datasetName or "mnist"
-    train_loader, test_loader = load_dataset(dataset_name, batch_size)
+def _build_embedding(node):
+    return nn.Embedding(node.numEmbeddings or 16, node.embeddingDim or 16)
 
-    global layers, sorted_nodes, graph_nodes, graph_edges
-    global plot_loss_history 
 
-    sorted_nodes = topological_sort(graph.nodes, graph.edges)
+def _build_softmax(node):
+    dim = node.softmaxDim if node.softmaxDim is not None else -1
+    return nn.Softmax(dim = dim)
 
-    graph_edges = graph.edges
-    graph_nodes = graph.nodes
 
-    layers={}
-    for node in sorted_nodes:
-        t=node.type.lower()
-        if t == "linear":
-            layers[node.id] = nn.Linear(node.inFeatures, node.outFeatures)
+def _build_batchnorm1d(node):
+    return nn.BatchNorm1d(node.numFeatures)
 
-        elif t == "relu":
-            layers[node.id] = nn.ReLU()
 
-        elif t == "dropout":
-            p = 0.5 if node.p is None else float(node.p)
-            layers[node.id] = nn.Dropout(p)
+def _build_batchnorm2d(node):
+    return nn.BatchNorm2d(node.numFeatures)
 
-        elif t == "layernorm":
-            norm_shape = node.normalizedShape or node.inFeatures
-            layers[node.id] = nn.LayerNorm(norm_shape)
 
-        elif t == "convtranspose1d": # t == "convtranspose"
-                layers[node.id] = nn.ConvTranspose1d(
-                    node.inChannels, node.outChannels,
-                    kernel_size=node.kernelSize or 3,
-                    stride=node.stride or 1,
-                    padding=node.padding or 0
-                )
-        elif t == "convtranspose2d":
-                layers[node.id] = nn.ConvTranspose2d(
-                    node.inChannels, node.outChannels,
-                    kernel_size=(node.kernelH or 3, node.kernelW or 3),
-                    stride=(node.strideH or 1, node.strideW or 1),
-                    padding=(node.padH or 0, node.padW or 0)
-                )
-        elif t == "convtranspose3d":
-                layers[node.id] = nn.ConvTranspose3d(
-                    node.inChannels, node.outChannels,
-                    kernel_size=(node.kernelD or 3, node.kernelH or 3, node.kernelW or 3),
-                    stride=(node.strideD or 1, node.strideH or 1, node.strideW or 1),
-                    padding=(node.padD or 0, node.padH or 0, node.padW or 0)
-                )
+# ---- input adapters ----
 
-        elif t == "conv1d":
-                layers[node.id] = nn.Conv1d(
-                    node.inChannels, node.outChannels,
-                    kernel_size=node.kernelSize or 3,
-                    stride=node.stride or 1,
-                    padding=node.padding or 0
-                )
-        elif t == "conv2d":
-                layers[node.id] = nn.Conv2d(
-                    node.inChannels, node.outChannels,
-                    kernel_size=(node.kernelH or 3, node.kernelW or 3),
-                    stride=(node.strideH or 1, node.strideW or 1),
-                    padding=(node.padH or 0, node.padW or 0)
-                )
-        elif t == "conv3d":
-                layers[node.id] = nn.Conv3d(
-                    node.inChannels, node.outChannels,
-                    kernel_size=(node.kernelD or 3, node.kernelH or 3, node.kernelW or 3),
-                    stride=(node.strideD or 1, node.strideH or 1, node.strideW or 1),
-                    padding=(node.padD or 0, node.padH or 0, node.padW or 0)
-                )
+def _run_spatial2d(t):
+    def run(layer, current, incoming):
+        if current.dim() != 4:
+            raise ValueError(f"{t} expects 4D input [B,C,H,W], got {current.shape}")
+        return layer(current)
+    return run
 
-        elif t == "maxpool1d":
-            layers[node.id] = nn.MaxPool1d(node.kernel or 2, node.stride or 1)
 
-        elif t == "maxpool2d":
-            layers[node.id] = nn.MaxPool2d(
-                kernel_size=(node.kernelH or 2, node.kernelW or 2),
-                stride=(node.strideH or 2, node.strideW or 2)
-            )
+def _run_spatial1d(layer, current, incoming):
+    if current.dim() == 4:
+        current = current.reshape(current.size(0), -1)
+    if current.dim() == 2:
+        current = current.unsqueeze(2)
+    elif current.dim() == 3 and current.shape[1] == 1:
+        current = current.transpose(1, 2)
+    return layer(current)
 
-        elif t == "maxpool3d":
-            layers[node.id] = nn.MaxPool3d(
-                kernel_size=(
-                    node.kernelD or 2,
-                    node.kernelH or 2,
-                    node.kernelW or 2,
-                ),
-                stride=(
-                    node.strideD or 2,
-                    node.strideH or 2,
-                    node.strideW or 2,
-                )
-            )
 
-        elif t == "avgpool1d":
-            layers[node.id] = nn.AvgPool1d(node.kernel or 2, node.stride or 1)
-
-        elif t == "avgpool2d":
-            layers[node.id] = nn.AvgPool2d(
-                kernel_size=(
-                    node.kernelH or 2,
-                    node.kernelW or 2,
-                ),
-                stride=(
-                    node.strideH or 2,
-                    node.strideW or 2,
-                )
-            )
+def _run_flat(layer, current, incoming):
+    return layer(_flatten(current))
 
-        elif t == "avgpool3d":
-            layers[node.id] = nn.AvgPool3d(
-                kernel_size=(
-                    node.kernelD or 2,
-                    node.kernelH or 2,
-                    node.kernelW or 2,
-                ),
-                stride=(
-                    node.strideD or 2,
-                    node.strideH or 2,
-                    node.strideW or 2,
-                )
-            )
 
-        elif t =="adaptiveavgpool1d":
-                layers[node.id] = nn.AdaptiveAvgPool1d(node.outputSize or 1) 
+def _run_direct(layer, current, incoming):
+    return layer(current)
 
-        elif t =="adaptiveavgpool2d":
-                layers[node.id] = nn.AdaptiveAvgPool2d(node.outputSize or 1) 
 
-        elif t == "embedding":
-            layers[node.id] = nn.Embedding(
-                node.numEmbeddings or 16,
-                node.embeddingDim or 16
-            )
+def _run_concat(layer, current, incoming):
+    return current
 
-        elif t == "concat":
-            layers[node.id] = None
-        
-        elif t == "softmax":
-            dim = node.softmaxDim if node.softmaxDim is not None else -1
-            layers[node.id] = nn.Softmax(dim = dim)
-
-        elif t == "matmul":
-            layers[node.id] = None
-        
-        elif t == "scale":
-            layers[node.id] = None
-
-        elif t == "mask":
-            layers[node.id] = None
-
-        elif t == "batchnorm":
-            mode = getattr(node, "mode", "1d")
-
-            if mode == "1d":
-                layers[node.id] = nn.BatchNorm1d(node.numFeatures)
-            elif mode == "2d":
-                layers[node.id] = nn.BatchNorm2d(node.numFeatures)
-            else:
-                raise ValueError(f"Unsupported BatchNorm mode: {mode}")
-            
-        elif t == "ui":
-            continue
-    
-    
-    params = []
-    for m in layers.values():
-        if m is not None:
-            params += list(m.parameters())
-    
-    optimizer = torch.optim.SGD(params, lr=lr)
 
-    loss_history = []
-    clean_loss_history = []
+def _run_embedding(layer, current, incoming):
+    return layer(_flatten(current).long()).mean(dim=1)
+
+
+def _run_matmul(layer, current, incoming):
+    a, b = incoming
+    return torch.matmul(a, b.T)
+
+
+def _run_scale(layer, current, incoming):
+    current = _flatten(current)
+    return current / math.sqrt(current.shape[-1])
+
+
+def _run_mask(layer, current, incoming):
+    scores = incoming[0]
+    T = scores.shape[-1]
+    mask = torch.triu(
+        torch.ones(T, T, device=scores.device),
+        diagonal=1
+    ) * (-1e9)
+    return scores + mask
+
+
+def _run_batchnorm1d(layer, current, incoming):
+    current = _flatten(current)
+    if current.dim() in (2, 3):
+        current = layer(current)
+    return current
+
+
+def _run_batchnorm2d(layer, current, incoming):
+    if current.dim() != 4:
+        raise ValueError(f"BatchNorm2d expects 4D input, got {current.shape}")
+    return layer(current)
+
+
+# ---- output shapes ----
+# Each takes (node, shape, incoming_shapes) where shape is the input after
+# the concat/first-input rule, and mirrors the matching adapter + layer.
+
+def _shape_same(node, shape, incoming):
+    return shape
+
+
+def _shape_flat(node, shape, incoming):
+    return _flat_shape(shape)
+
+
+def _shape_linear(node, shape, incoming):
+    shape = _flat_shape(shape)
+    if shape[-1] != node.inFeatures:
+        raise ValueError(
+            f"linear '{node.id}' expects {node.inFeatures} input features, got shape {list(shape)}"
+        )
+    return shape[:-1] + (node.outFeatures,)
+
+
+def _shape_layernorm(node, shape, incoming):
+    shape = _flat_shape(shape)
+    expected = node.normalizedShape or node.inFeatures
+    if shape[-1] != expected:
+        raise ValueError(
+            f"layernorm '{node.id}' expects {expected} features, got shape {list(shape)}"
+        )
+    return shape
+
+
+def _spatial1d_shape(node, shape):
+    if len(shape) == 4:
+        shape = _flat_shape(shape)
+    if len(shape) == 2:
+        shape = shape + (1,)
+    elif len(shape) == 3 and shape[1] == 1:
+        shape = (shape[0], shape[2], shape[1])
+    if len(shape) != 3:
+        raise ValueError(f"{node.type} '{node.id}' cannot take input of shape {list(shape)}")
+    return shape
+
+
+def _require_dims(node, shape, dims):
+    if len(shape) != dims:
+        raise ValueError(f"{node.type} expects {dims}D input, got shape {list(shape)}")
+
+
+def _shape_conv1d(node, shape, incoming):
+    shape = _spatial1d_shape(node, shape)
+    _check_channels(node, shape, node.inChannels)
+    length = _conv_out(shape[2], node.kernelSize or 3, node.stride or 1, node.padding or 0)
+    return (shape[0], node.outChannels, length)
+
+
+def _shape_convtranspose1d(node, shape, incoming):
+    shape = _spatial1d_shape(node, shape)
+    _check_channels(node, shape, node.inChannels)
+    length = _conv_transpose_out(shape[2], node.kernelSize or 3, node.stride or 1, node.padding or 0)
+    return (shape[0], node.outChannels, length)
+
+
+def _shape_pool1d(node, shape, incoming):
+    shape = _spatial1d_shape(node, shape)
+    length = _conv_out(shape[2], node.kernel or 2, node.stride or 1, 0)
+    return shape[:2] + (length,)
+
+
+def _shape_adaptiveavgpool1d(node, shape, incoming):
+    shape = _spatial1d_shape(node, shape)
+    return shape[:2] + (node.outputSize or 1,)
+
+
+def _shape_conv2d(node, shape, incoming):
+    _require_dims(node, shape, 4)
+    _check_channels(node, shape, node.inChannels)
+    return (
+        shape[0], node.outChannels,
+        _conv_out(shape[2], node.kernelH or 3, node.strideH or 1, node.padH or 0),
+        _conv_out(shape[3], node.kernelW or 3, node.strideW or 1, node.padW or 0),
+    )
+
+
+def _shape_convtranspose2d(node, shape, incoming):
+    _require_dims(node, shape, 4)
+    _check_channels(node, shape, node.inChannels)
+    return (
+        shape[0], node.outChannels,
+        _conv_transpose_out(shape[2], node.kernelH or 3, node.strideH or 1, node.padH or 0),
+        _conv_transpose_out(shape[3], node.kernelW or 3, node.strideW or 1, node.padW or 0),
+    )
+
+
+def _shape_pool2d(node, shape, incoming):
+    _require_dims(node, shape, 4)
+    return (
+        shape[0], shape[1],
+        _conv_out(shape[2], node.kernelH or 2, node.strideH or 2, 0),
+        _conv_out(shape[3], node.kernelW or 2, node.strideW or 2, 0),
+    )
+
+
+def _shape_adaptiveavgpool2d(node, shape, incoming):
+    _require_dims(node, shape, 4)
+    size = node.outputSize or 1
+    return (shape[0], shape[1], size, size)
+
+
+def _shape_conv3d(node, shape, incoming):
+    _require_dims(node, shape, 5)
+    _check_channels(node, shape, node.inChannels)
+    return (
+        shape[0], node.outChannels,
+        _conv_out(shape[2], node.kernelD or 3, node.strideD or 1, node.padD or 0),
+        _conv_out(shape[3], node.kernelH or 3, node.strideH or 1, node.padH or 0),
+        _conv_out(shape[4], node.kernelW or 3, node.strideW or 1, node.padW or 0),
+    )
+
+
+def _shape_convtranspose3d(node, shape, incoming):
+    _require_dims(node, shape, 5)
+    _check_channels(node, shape, node.inChannels)
+    return (
+        shape[0], node.outChannels,
+        _conv_transpose_out(shape[2], node.kernelD or 3, node.strideD or 1, node.padD or 0),
+        _conv_transpose_out(shape[3], node.kernelH or 3, node.strideH or 1, node.padH or 0),
+        _conv_transpose_out(shape[4], node.kernelW or 3, node.strideW or 1, node.padW or 0),
+    )
+
+
+def _shape_pool3d(node, shape, incoming):
+    _require_dims(node, shape, 5)
+    return (
+        shape[0], shape[1],
+        _conv_out(shape[2], node.kernelD or 2, node.strideD or 2, 0),
+        _conv_out(shape[3], node.kernelH or 2, node.strideH or 2, 0),
+        _conv_out(shape[4], node.kernelW or 2, node.strideW or 2, 0),
+    )
+
+
+def _shape_embedding(node, shape, incoming):
+    shape = _flat_shape(shape)
+    return shape[:1] + shape[2:] + (node.embeddingDim or 16,)
+
+
+def _shape_matmul(node, shape, incoming):
+    if len(incoming) != 2:
+        raise ValueError(f"matmul '{node.id}' needs exactly 2 inputs, got {len(incoming)}")
+    a, b = incoming
+    if len(a) != 2 or len(b) != 2:
+        return None
+    if a[1] != b[1]:
+        raise ValueError(f"matmul '{node.id}' cannot multiply {list(a)} by {list(b)}.T")
+    return (a[0], b[0])
+
+
+def _shape_mask(node, shape, incoming):
+    scores = incoming[0]
+    try:
+        return tuple(torch.broadcast_shapes(scores, (scores[-1], scores[-1])))
+    except RuntimeError:
+        raise ValueError(f"mask '{node.id}' cannot apply a causal mask to shape {list(scores)}")
+
+
+def _shape_batchnorm1d(node, shape, incoming):
+    shape = _flat_shape(shape)
+    if len(shape) in (2, 3):
+        _check_channels(node, shape, node.numFeatures)
+    return shape
+
+
+def _shape_batchnorm2d(node, shape, incoming):
+    _require_dims(node, shape, 4)
+    _check_channels(node, shape, node.numFeatures)
+    return shape
+
+
+class BlockType(NamedTuple):
+    build: Optional[Callable]   # node -> nn.Module, None for parameter-free ops
+    run: Callable               # (layer, current, incoming) -> tensor
+    output_shape: Callable      # (node, shape, incoming_shapes) -> shape
+    batch_independent: bool = True  # False if one sample's output depends on the others
+
+
+# Every block type the editor can produce. "batchnorm" nodes are looked up
+# as batchnorm1d / batchnorm2d according to their mode.
+BLOCK_TYPES = {
+    "linear": BlockType(_build_linear, _run_flat, _shape_linear),
+    "relu": BlockType(_build_relu, _run_direct, _shape_same),
+    "dropout": BlockType(_build_dropout, _run_direct, _shape_same),
+    "softmax": BlockType(_build_softmax, _run_direct, _shape_same),
+    "layernorm": BlockType(_build_layernorm, _run_flat, _shape_layernorm),
+    "conv1d": BlockType(_build_conv1d, _run_spatial1d, _shape_conv1d),
+    "conv2d": BlockType(_build_conv2d, _run_spatial2d("conv2d"), _shape_conv2d),
+    "conv3d": BlockType(_build_conv3d, _run_direct, _shape_conv3d),
+    "convtranspose1d": BlockType(_build_convtranspose1d, _run_spatial1d, _shape_convtranspose1d),
+    "convtranspose2d": BlockType(_build_convtranspose2d, _run_spatial2d("convtranspose2d"), _shape_convtranspose2d),
+    "convtranspose3d": BlockType(_build_convtranspose3d, _run_direct, _shape_convtranspose3d),
+    "maxpool1d": BlockType(_build_maxpool1d, _run_spatial1d, _shape_pool1d),
+    "maxpool2d": BlockType(_build_maxpool2d, _run_spatial2d("maxpool2d"), _shape_pool2d),
+    "maxpool3d": BlockType(_build_maxpool3d, _run_direct, _shape_pool3d),
+    "avgpool1d": BlockType(_build_avgpool1d, _run_spatial1d, _shape_pool1d),
+    "avgpool2d": BlockType(_build_avgpool2d, _run_spatial2d("avgpool2d"), _shape_pool2d),
+    "avgpool3d": BlockType(_build_avgpool3d, _run_direct, _shape_pool3d),
+    "adaptiveavgpool1d": BlockType(_build_adaptiveavgpool1d, _run_spatial1d, _shape_adaptiveavgpool1d),
+    "adaptiveavgpool2d": BlockType(_build_adaptiveavgpool2d, _run_spatial2d("adaptiveavgpool2d"), _shape_adaptiveavgpool2d),
+    "embedding": BlockType(_build_embedding, _run_embedding, _shape_embedding),
+    "batchnorm1d": BlockType(_build_batchnorm1d, _run_batchnorm1d, _shape_batchnorm1d),
+    "batchnorm2d": BlockType(_build_batchnorm2d, _run_batchnorm2d, _shape_batchnorm2d),
+    "concat": BlockType(None, _run_concat, _shape_same),
+    "matmul": BlockType(None, _run_matmul, _shape_matmul, batch_independent=False),
+    "scale": BlockType(None, _run_scale, _shape_flat),
+    "mask": BlockType(None, _run_mask, _shape_mask, batch_independent=False),
+}
+
+
+# Blocks that run on NCHW tensors and benefit from channels_last memory format.
+CHANNELS_LAST_BLOCKS = {
+    "conv2d", "convtranspose2d", "maxpool2d", "avgpool2d", "adaptiveavgpool2d", "batchnorm2d",
+}
+
+
+def block_type_key(node):
+    t = node.type.lower()
+    if t == "batchnorm":
+        mode = getattr(node, "mode", "1d")
+        if mode not in ("1d", "2d"):
+            raise ValueError(f"Unsupported BatchNorm mode: {mode}")
+        return "batchnorm" + mode
+    if t not in BLOCK_TYPES:
+        raise ValueError(f"Unknown node type {node.type}")
+    return t
+
+
+class ResolvedGraph(NamedTuple):
+    """
+    The weight-independent part of a CompiledGraph: one step per
+    executable node with its BlockType, input slots and shape rule.
+    """
+    sorted_graph: SortedGraph
+    steps: tuple
+    spatial2d: bool
+    batch_independent: bool
+
+
+def resolve_graph(sorted_graph):
+    slots = {}
+    steps = []
+    spatial2d = False
+    batch_independent = True
+    for node in sorted_graph.nodes:
+        if node.type.lower() == "ui":
+            continue
+
+        key = block_type_key(node)
+        spec = BLOCK_TYPES[key]
+        spatial2d = spatial2d or key in CHANNELS_LAST_BLOCKS
+        batch_independent = batch_independent and spec.batch_independent
+
+        input_slots = []
+        for source in sorted_graph.incoming[node.id]:
+            if source not in slots:
+                raise RuntimeError(
+                    f"Edge error: '{source}' -> '{node.id}' "
+                    f"but source is not computed yet"
+                )
+            input_slots.append(slots[source])
+
+        slots[node.id] = len(steps)
+        steps.append((node, spec, tuple(input_slots), spec.run is _run_concat, partial(spec.output_shape, node)))
+
+    if not steps:
+        raise ValueError("Graph has no executable blocks")
+    return ResolvedGraph(sorted_graph, tuple(steps), spatial2d, batch_independent)
+
+
+class CompiledGraph(nn.Module):
+    """
+    Executable form of a block graph.
+
+    Every node is looked up in BLOCK_TYPES once when the graph is built;
+    layers, reshape rules and incoming edges are resolved up front, so
+    forward() only walks a flat list of integer slots.
+    """
+
+    precision = "fp32"
+    channels_last = False
+
+    def __init__(self, sorted_nodes, incoming, layers=None):
+        super().__init__()
+        resolved = resolve_graph(SortedGraph(sorted_nodes, incoming))
+        self.node_ids = []
+        self.blocks = nn.ModuleList()
+        self.plan = []
+        self.shape_plan = []
+        self.spatial2d = resolved.spatial2d
+        self.batch_independent = resolved.batch_independent
+
+        for node, spec, input_slots, concat, output_shape in resolved.steps:
+            if layers is not None:
+                layer = layers.get(node.id)
+            else:
+                layer = spec.build(node) if spec.build is not None else None
+            if layer is not None:
+                self.blocks.append(layer)
+
+            self.node_ids.append(node.id)
+            self.plan.append((input_slots, concat, partial(spec.run, layer)))
+            self.shape_plan.append((input_slots, concat, output_shape))
+
+    def set_execution(self, precision="fp32", channels_last=False):
+        """
+        Opt-in execution mode: "bf16" runs forward under autocast and
+        returns float32 outputs; channels_last only applies to graphs
+        with 2d spatial blocks.
+        """
+        self.precision = precision or "fp32"
+        self.channels_last = bool(channels_last) and self.spatial2d
+        if self.channels_last:
+            self.to(memory_format=torch.channels_last)
+        return self
+
+    def forward(self, z):
+        if self.channels_last and z.dim() == 4:
+            z = z.contiguous(memory_format=torch.channels_last)
+        if self.precision == "bf16":
+            with torch.autocast(z.device.type, dtype=torch.bfloat16):
+                return self._forward(z).float()
+        return self._forward(z)
+
+    def _forward(self, z):
+        outputs = []
+        for input_slots, concat, run in self.plan:
+            incoming = [outputs[i] for i in input_slots]
+            if not incoming:
+                current = z
+            elif concat:
+                current = torch.cat(incoming, dim=1)
+            else:
+                current = incoming[0]
+            outputs.append(run(current, incoming))
+        return outputs[-1]
+
+    def output_shapes(self, input_shape):
+        """
+        Propagate an input shape through the graph without running it.
+        Raises ValueError naming the first block whose input does not fit;
+        blocks whose shape cannot be known statically map to None.
+        """
+        shapes = []
+        for input_slots, concat, output_shape in self.shape_plan:
+            incoming = [shapes[i] for i in input_slots]
+            if any(s is None for s in incoming):
+                shapes.append(None)
+                continue
+            if not incoming:
+                shape = tuple(input_shape)
+            elif concat:
+                first = incoming[0]
+                if any(len(s) != len(first) or s[:1] + s[2:] != first[:1] + first[2:] for s in incoming):
+                    raise ValueError(f"concat inputs do not match: {[list(s) for s in incoming]}")
+                shape = first[:1] + (sum(s[1] for s in incoming),) + first[2:]
+            else:
+                shape = incoming[0]
+            shape = output_shape(shape, incoming)
+            shapes.append(tuple(shape) if shape is not None else None)
+        return dict(zip(self.node_ids, shapes))
+
+
+def graph_fingerprint(graph):
+    """
+    Content hash of the parts of a GraphRequest that decide the model:
+    nodes with their hyperparameters and edges. Training settings are
+    left out.
+    """
+    blob = graph.model_dump_json(include={"nodes", "edges"}, exclude_none=True)
+    return hashlib.sha256(blob.encode()).hexdigest()
+
+
+def build_graph(graph):
+    """
+    Sort `graph` and build a fresh CompiledGraph for it. Nothing is cached:
+    every submission trains from its own random initialisation, and
+    building the layers costs far more than the sort and BLOCK_TYPES
+    lookups a cache could skip.
+    """
+    sorted_graph = topological_sort(graph.nodes, graph.edges)
+    return sorted_graph, CompiledGraph(sorted_graph.nodes, sorted_graph.incoming)
+
+
+class BackendEntry(NamedTuple):
+    artifact: object
+    error: Optional[str]
+
+
+class BackendCache(LRUCache):
+    """
+    LRU of training backend results keyed by graph_fingerprint(), backend,
+    input shape and execution mode.
+
+    "trace" entries keep the traced TorchScript module as a template that
+    is deep-copied and loaded with the request's weights; "compile" entries
+    only record success, torch.compile keeps its generated code itself.
+    Failures are cached too, so a graph that cannot be traced goes straight
+    to eager on the next request.
+    """
+
+    def stats(self):
+        stats = super().stats()
+        stats["failed"] = sum(e.error is not None for e in self.values())
+        return stats
+
+
+backend_cache = BackendCache(int(os.environ.get("BLOCKBUILD_BACKEND_CACHE_SIZE", 32)))
+TRAIN_BACKEND = os.environ.get("BLOCKBUILD_BACKEND", "eager")
+
+
+def _warm_up(runner, model, example):
+    # One forward/backward so torch.compile builds the training graph now;
+    # gradients and batchnorm statistics are put back afterwards.
+    buffers = [b.clone() for b in model.buffers()]
+    runner(example).float().sum().backward()
+    model.zero_grad(set_to_none=True)
+    with torch.no_grad():
+        for b, saved in zip(model.buffers(), buffers):
+            b.copy_(saved)
+
+
+def compile_for_training(graph, model, example, backend="eager"):
+    """
+    Module to train `model` with on the requested backend, falling back to
+    eager when tracing or compiling fails. Returns (runner, backend_used,
+    compile_seconds, error). A "trace" runner holds its own weights; copy
+    them back with model.load_state_dict(runner.state_dict()).
+    """
+    if backend == "eager":
+        return model, "eager", 0.0, None
+
+    key = (graph_fingerprint(graph), backend, tuple(example.shape), model.precision, model.channels_last)
+    entry = backend_cache.get(key)
+    if entry is not None and entry.error is not None:
+        return model, "eager", 0.0, entry.error
+
+    start = time.perf_counter()
+    try:
+        if backend == "trace":
+            template = entry.artifact if entry is not None else torch.jit.trace(
+                copy.deepcopy(model), example, check_trace=False
+            )
+            # Copied under no_grad, or the copy's parameters are not leaves.
+            with torch.no_grad():
+                runner = copy.deepcopy(template)
+            for p in runner.parameters():
+                p.requires_grad_(True)
+            runner.load_state_dict(model.state_dict())
+        else:
+            template = None
+            runner = torch.compile(model)
+            if entry is None:
+                _warm_up(runner, model, example)
+    except Exception as e:
+        error = f"{backend} failed: {type(e).__name__}: {str(e).splitlines()[0] if str(e) else ''}"
+        backend_cache.put(key, BackendEntry(None, error))
+        return model, "eager", time.perf_counter() - start, error
+
+    if entry is None:
+        backend_cache.put(key, BackendEntry(template, None))
+    return runner, backend, time.perf_counter() - start, None
+
+
+_session_versions = itertools.count(1)
+
+
+class ModelSession:
+    def __init__(self, model_id, model, sorted_graph, loss_history):
+        self.model_id = model_id
+        self.version = next(_session_versions)
+        self.model = model
+        self.sorted_graph = sorted_graph
+        self.loss_history = loss_history
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+        self.nbytes = sum(t.numel() * t.element_size() for t in model.state_dict().values())
+
+    def forward(self, z):
+        with self.lock:
+            self.last_used = time.monotonic()
+            return self.model(z)
+
+
+class ModelStore:
+    """
+    Trained models keyed by model id. Least recently used models are
+    dropped once there are more than max_models, their weights exceed
+    max_bytes, or they have been idle for max_idle seconds.
+    """
+
+    def __init__(self, max_models=16, max_bytes=1 << 30, max_idle=3600, loader=None):
+        self.max_models = max_models
+        self.max_bytes = max_bytes
+        self.max_idle = max_idle
+        self.loader = loader
+        self.sessions = OrderedDict()
+        self.latest_id = None
+        self.lock = threading.Lock()
+
+    def add(self, session, latest=True):
+        with self.lock:
+            self.sessions.pop(session.model_id, None)
+            self.sessions[session.model_id] = session
+            if latest or self.latest_id is None:
+                self.latest_id = session.model_id
+            self._evict()
+
+    def get(self, model_id=None, load=True):
+        """
+        Look up a model; without an id, the most recently trained one.
+        Ids that are not in memory go to loader (saved checkpoints) unless
+        load is False.
+        """
+        with self.lock:
+            self._evict()
+            if model_id is None:
+                model_id = self.latest_id
+            session = self.sessions.get(model_id)
+            if session is not None:
+                self.sessions.move_to_end(model_id)
+                session.last_used = time.monotonic()
+                return session
+        if model_id is None or self.loader is None or not load:
+            return None
+        session = self.loader(model_id)
+        if session is not None:
+            self.add(session, latest=False)
+        return session
+
+    def _evict(self):
+        now = time.monotonic()
+        total = sum(s.nbytes for s in self.sessions.values())
+        while self.sessions:
+            oldest_id, oldest = next(iter(self.sessions.items()))
+            if (len(self.sessions) <= self.max_models
+                    and total <= self.max_bytes
+                    and now - oldest.last_used <= self.max_idle):
+                break
+            if oldest_id == self.latest_id and len(self.sessions) == 1:
+                break
+            del self.sessions[oldest_id]
+            total -= oldest.nbytes
+
+    def stats(self):
+        with self.lock:
+            return {
+                "models": len(self.sessions),
+                "max_models": self.max_models,
+                "bytes": sum(s.nbytes for s in self.sessions.values()),
+                "max_bytes": self.max_bytes,
+            }
+
+
+# Checkpoints are .safetensors files: an 8-byte little-endian header
+# length, a JSON header mapping each state_dict key to its dtype, shape
+# and byte range, then the raw tensor bytes back to back. The graph,
+# loss history and execution mode ride along in the header's
+# __metadata__ (string values only, as safetensors requires).
+
+MODEL_DIR = Path(os.environ.get("BLOCKBUILD_MODEL_DIR", "./models"))
+MODEL_AUTOLOAD = os.environ.get("BLOCKBUILD_MODEL_AUTOLOAD", "1") != "0"
+
+CHECKPOINT_DTYPES = {
+    "F64": torch.float64, "F32": torch.float32, "F16": torch.float16, "BF16": torch.bfloat16,
+    "I64": torch.int64, "I32": torch.int32, "I16": torch.int16, "I8": torch.int8,
+    "U8": torch.uint8, "BOOL": torch.bool,
+}
+CHECKPOINT_DTYPE_NAMES = {dtype: name for name, dtype in CHECKPOINT_DTYPES.items()}
+
+
+def checkpoint_path(model_id):
+    if not re.fullmatch(r"[A-Za-z0-9_-]+", model_id):
+        raise ValueError(f"Invalid model id: {model_id!r}")
+    return MODEL_DIR / f"{model_id}.safetensors"
+
+
+def write_checkpoint(path, tensors, metadata):
+    """
+    Write tensors widest dtype first, so with the header padded to a
+    multiple of 8 every tensor starts aligned to its element size. The
+    file is written next to path and renamed over it: processes that
+    still map the old file keep reading the old weights.
+    """
+    header = {"__metadata__": metadata}
+    blobs = []
+    offset = 0
+    for name, t in sorted(tensors.items(), key=lambda item: -item[1].element_size()):
+        t = t.detach().cpu().contiguous()
+        if t.dtype not in CHECKPOINT_DTYPE_NAMES:
+            raise ValueError(f"Unsupported dtype for {name}: {t.dtype}")
+        blob = t.reshape(-1).view(torch.uint8).numpy()
+        header[name] = {
+            "dtype": CHECKPOINT_DTYPE_NAMES[t.dtype],
+            "shape": list(t.shape),
+            "data_offsets": [offset, offset + blob.nbytes],
+        }
+        blobs.append(blob)
+        offset += blob.nbytes
+
+    header_bytes = json.dumps(header, separators=(",", ":")).encode()
+    header_bytes += b" " * (-len(header_bytes) % 8)
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        with open(tmp, "wb") as f:
+            f.write(struct.pack("<Q", len(header_bytes)))
+            f.write(header_bytes)
+            for blob in blobs:
+                f.write(blob.data)
+        os.replace(tmp, path)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+    return 8 + len(header_bytes) + offset
+
+
+def read_checkpoint(path):
+    """
+    Map a checkpoint and return (tensors, metadata) without reading the
+    weights. Tensors are views into a private copy-on-write mapping:
+    pages are faulted in from the page cache as they are used, shared by
+    every process that maps the same file, and only copied if written.
+    """
+    with open(path, "rb") as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    try:
+        (header_len,) = struct.unpack_from("<Q", buf, 0)
+        header = json.loads(buf[8:8 + header_len])
+    except (struct.error, ValueError):
+        raise ValueError(f"Not a checkpoint: {path}") from None
+    if not isinstance(header, dict):
+        raise ValueError(f"Not a checkpoint: {path}")
+    metadata = header.pop("__metadata__", None) or {}
+    if not isinstance(metadata, dict):
+        raise ValueError(f"Malformed checkpoint metadata: {path}")
+
+    start = 8 + header_len
+    tensors = {}
+    for name, info in header.items():
+        dtype, shape, begin, count = _checkpoint_entry(name, info, len(buf) - start)
+        if count == 0:
+            tensors[name] = torch.empty(shape, dtype=dtype)
+        else:
+            tensors[name] = torch.frombuffer(buf, dtype=dtype, count=count, offset=start + begin).view(shape)
+    return tensors, metadata
+
+
+def _checkpoint_entry(name, info, data_len):
+    """(dtype, shape, begin, count) of one header entry, checked against the data it points at."""
+    try:
+        dtype = CHECKPOINT_DTYPES[info["dtype"]]
+        shape = list(info["shape"])
+        begin, end = info["data_offsets"]
+    except (KeyError, TypeError, ValueError):
+        raise ValueError(f"Malformed checkpoint entry: {name}") from None
+    if not all(isinstance(d, int) and d >= 0 for d in shape):
+        raise ValueError(f"Invalid shape for {name}: {shape}")
+    if not (isinstance(begin, int) and isinstance(end, int) and 0 <= begin <= end <= data_len):
+        raise ValueError(f"Invalid data_offsets for {name}: {[begin, end]}")
+    count = math.prod(shape)
+    if end - begin != count * dtype.itemsize:
+        raise ValueError(f"data_offsets of {name} do not match shape {shape} and dtype {info['dtype']}")
+    return dtype, shape, begin, count
+
+
+def save_checkpoint(session):
+    """Persist a trained session; returns (path, bytes written)."""
+    if not isinstance(session.model, CompiledGraph) or session.sorted_graph is None:
+        raise ValueError("Model has no graph definition to save")
+    sorted_graph = session.sorted_graph
+    # Nodes are stored in their sorted order, so loading rebuilds the
+    # blocks (and state_dict keys) in exactly the same order.
+    graph = {
+        "nodes": [n.model_dump(exclude_none=True) for n in sorted_graph.nodes],
+        "edges": [
+            {"source": source, "target": n.id}
+            for n in sorted_graph.nodes
+            for source in sorted_graph.incoming[n.id]
+        ],
+    }
+    metadata = {
+        "format": "blockbuild",
+        "graph": json.dumps(graph),
+        "loss_history": json.dumps(session.loss_history),
+        "precision": session.model.precision,
+        "channels_last": json.dumps(session.model.channels_last),
+    }
+    path = checkpoint_path(session.model_id)
+    return path, write_checkpoint(path, session.model.state_dict(), metadata)
+
+
+def load_checkpoint(model_id):
+    """
+    Rebuild a saved model around its memory-mapped weights; None if there
+    is no checkpoint. Layers are built on the meta device, so nothing is
+    allocated or initialised, and load_state_dict(assign=True) puts the
+    mapped tensors in place; only channels_last models copy their conv
+    weights when set_execution converts them.
+    """
+    path = checkpoint_path(model_id)
+    if not path.exists():
+        return None
+    tensors, metadata = read_checkpoint(path)
+    if metadata.get("format") != "blockbuild" or "graph" not in metadata:
+        raise ValueError(f"Not a BlockBuild checkpoint: {path}")
+
+    try:
+        graph = json.loads(metadata["graph"])
+        nodes = [NodeData(**n) for n in graph["nodes"]]
+        incoming = {n.id: [] for n in nodes}
+        for e in graph["edges"]:
+            incoming[e["target"]].append(e["source"])
+        loss_history = list(json.loads(metadata.get("loss_history", "[]")))
+        channels_last = bool(json.loads(metadata.get("channels_last", "false")))
+    except (KeyError, TypeError, ValueError):
+        # pydantic's ValidationError is a ValueError too.
+        raise ValueError(f"Malformed graph metadata: {path}") from None
+    sorted_graph = SortedGraph(nodes, incoming)
+
+    try:
+        with torch.device("meta"):
+            model = CompiledGraph(sorted_graph.nodes, sorted_graph.incoming)
+        model.load_state_dict(tensors, assign=True)
+    except (RuntimeError, ValueError, KeyError, TypeError, AttributeError) as e:
+        raise ValueError(f"Checkpoint does not match its graph: {e}") from None
+    model.set_execution(metadata.get("precision"), channels_last)
+    model.eval()
+
+    return ModelSession(model_id, model, sorted_graph, loss_history)
+
+
+def autoload_checkpoint(model_id):
+    """ModelStore loader: a saved model, or None for ids that cannot be loaded."""
+    try:
+        return load_checkpoint(model_id)
+    except (OSError, ValueError) as e:
+        warnings.warn(f"Could not load checkpoint for {model_id}: {e}")
+        return None
+
+
+model_store = ModelStore(
+    max_models=int(os.environ.get("BLOCKBUILD_MAX_MODELS", 16)),
+    max_bytes=int(os.environ.get("BLOCKBUILD_MAX_MODEL_BYTES", 1 << 30)),
+    max_idle=float(os.environ.get("BLOCKBUILD_MODEL_IDLE_SECONDS", 3600)),
+    loader=autoload_checkpoint if MODEL_AUTOLOAD else None,
+)
+
+
+def new_model_id():
+    return uuid.uuid4().hex
+
+
+class Job:
+    def __init__(self, job_id, fn, kind, priority):
+        self.job_id = job_id
+        self.fn = fn
+        self.kind = kind
+        self.priority = priority
+        self.status = "queued"
+        self.progress = {}
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.future = Future()
+        self.version = 0
+        self.epochs = []
+
+    def report(self, **progress):
+        self.progress = {**self.progress, **progress}
+        self.version += 1
+
+    def log_epoch(self, **summary):
+        self.epochs.append(summary)
+        self.version += 1
+
+    def summary(self, include_result=False):
+        info = {
+            "job_id": self.job_id,
+            "kind": self.kind,
+            "status": self.status,
+            "priority": self.priority,
+            "progress": self.progress,
+            "submitted": self.submitted,
+            "started": self.started,
+            "finished": self.finished,
+        }
+        if self.error is not None:
+            info["error"] = self.error
+        if include_result and self.status == "done":
+            info["result"] = self.future.result()
+        return info
+
+
+class JobQueue:
+    """
+    Fixed pool of worker threads running training jobs. Higher priority
+    jobs start first, equal priorities in submission order. Finished jobs
+    are kept for max_finished lookups. The workers start on the first
+    submit(), so importing this module starts no threads before the
+    training processes are forked.
+    """
+
+    def __init__(self, workers=2, max_pending=64, max_finished=256, name="train-worker"):
+        self.max_pending = max_pending
+        self.max_finished = max_finished
+        self.queue = queue.PriorityQueue()
+        self.jobs = OrderedDict()
+        self.pending = 0
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+        self.workers = [
+            threading.Thread(target=self._work, name=f"{name}-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        self.started = False
+
+    def submit(self, fn, kind="train", priority=0):
+        with self.lock:
+            if not self.started:
+                for worker in self.workers:
+                    worker.start()
+                self.started = True
+            if self.pending >= self.max_pending:
+                raise RuntimeError("Too many queued training jobs, try again later")
+            job = Job(uuid.uuid4().hex, fn, kind, priority)
+            self.pending += 1
+            self.jobs[job.job_id] = job
+            finished = [j for j in self.jobs.values() if j.finished is not None]
+            for old in finished[:max(0, len(finished) - self.max_finished)]:
+                del self.jobs[old.job_id]
+        self.queue.put((-priority, next(self.counter), job))
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def _work(self):
+        while True:
+            _, _, job = self.queue.get()
+            with self.lock:
+                self.pending -= 1
+            job.status = "running"
+            job.started = time.time()
+            try:
+                result = job.fn(job)
+            except Exception as e:
+                job.error = str(e)
+                job.status = "failed"
+                job.finished = time.time()
+                job.future.set_exception(e)
+            else:
+                job.status = "done"
+                job.finished = time.time()
+                job.future.set_result(result)
+
+    def stats(self):
+        with self.lock:
+            statuses = [j.status for j in self.jobs.values()]
+        return {
+            "workers": len(self.workers),
+            "queued": statuses.count("queued"),
+            "running": statuses.count("running"),
+            "done": statuses.count("done"),
+            "failed": statuses.count("failed"),
+        }
+
+
+# Inference and training get separate executors, so a queued training
+# job never holds up /run and /predict, and short jobs (manual /train,
+# /test_dataset) get a lane of their own instead of waiting behind
+# multi-minute dataset training. torch.set_num_threads() stores one value
+# per process, so everything in this process shares SERVER_THREADS.
+# Dataset training therefore runs on a process pool by default whenever
+# there is more than one CPU (BLOCKBUILD_TRAIN_PROCESSES=0 keeps it
+# in-process), each process capped at TRAIN_THREADS and SERVER_THREADS
+# getting the rest. Datasets go to the workers and trained weights come
+# back as shared-memory tensors.
+TRAIN_WORKERS = int(os.environ.get("BLOCKBUILD_TRAIN_WORKERS", 2))
+SHORT_JOB_WORKERS = int(os.environ.get("BLOCKBUILD_SHORT_JOB_WORKERS", 2))
+INFERENCE_WORKERS = int(os.environ.get("BLOCKBUILD_INFERENCE_WORKERS", 2))
+TRAIN_PROCESSES = int(os.environ.get(
+    "BLOCKBUILD_TRAIN_PROCESSES", min(TRAIN_WORKERS, available_cpus() // 2)
+))
+TRAIN_THREADS = int(os.environ.get(
+    "BLOCKBUILD_TRAIN_THREADS", max(1, available_cpus() // 2 // max(TRAIN_PROCESSES, 1))
+))
+SERVER_THREADS = int(os.environ.get(
+    "BLOCKBUILD_THREADS", max(1, available_cpus() - TRAIN_PROCESSES * TRAIN_THREADS)
+))
+torch.set_num_threads(SERVER_THREADS)
+
+training_processes = None
+_progress_queue = None
+
+training_jobs = JobQueue(
+    workers=TRAIN_WORKERS,
+    max_pending=int(os.environ.get("BLOCKBUILD_MAX_QUEUED_JOBS", 64)),
+)
+
+short_jobs = JobQueue(
+    workers=SHORT_JOB_WORKERS,
+    max_pending=int(os.environ.get("BLOCKBUILD_MAX_QUEUED_JOBS", 64)),
+    name="short-job",
+)
+
+inference_executor = ThreadPoolExecutor(
+    max_workers=INFERENCE_WORKERS,
+    thread_name_prefix="inference",
+)
+
+
+class _ProcessJob:
+    """Job stand-in inside a training process; progress is relayed to the parent's Job."""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+
+    def report(self, **progress):
+        _progress_queue.put(("report", self.job_id, progress))
+
+    def log_epoch(self, **summary):
+        _progress_queue.put(("log_epoch", self.job_id, summary))
+
+
+def _relay_progress():
+    while True:
+        method, job_id, payload = _progress_queue.get()
+        job = training_jobs.get(job_id)
+        if job is not None:
+            getattr(job, method)(**payload)
+
+
+def _init_train_process():
+    torch.set_num_threads(TRAIN_THREADS)
+
+
+def _fit_in_process(graph, train_ds, job_id):
+    batch_size = graph.batchSize or 64
+    if train_ds is None:
+        # Decoding path: the worker opens its own loader, in-process.
+        config = loader_config(graph)._replace(num_workers=0, prefetch_factor=None, persistent_workers=False)
+        train_loader = load_split(graph.datasetName or "mnist", "train", batch_size, True, fast=False, loader=config)
+    else:
+        train_loader = TensorBatchLoader(train_ds, batch_size, shuffle=True)
+
+    fit, error = fit_dataset(graph, train_loader, _ProcessJob(job_id) if job_id is not None else None)
+    if error is not None:
+        return None, None, error
+    # state_dict tensors are pickled into shared memory, not through the pipe.
+    return fit.model.state_dict(), fit._replace(model=None, sorted_graph=None), None
+
+
+def fit_in_worker_process(graph, train_loader, job=None):
+    """fit_dataset() on the training process pool; the model is rebuilt here from the returned weights."""
+    train_ds = train_loader.dataset if isinstance(train_loader, TensorBatchLoader) else None
+    if isinstance(train_ds, DecodedImages):
+        train_ds.share_memory()
+
+    future = training_processes.submit(_fit_in_process, graph, train_ds, job.job_id if job is not None else None)
+    state_dict, fit, error = future.result()
+    if error is not None:
+        return None, error
+
+    sorted_graph, model = build_graph(graph)
+    model.set_execution(graph.precision, graph.channelsLast)
+    model.load_state_dict(state_dict)
+    return fit._replace(model=model, sorted_graph=sorted_graph), None
+
+
+def _infer(session, x):
+    with torch.inference_mode():
+        return session.forward(x)
+
+
+async def run_inference(session, x):
+    """Forward pass on the inference executor, awaitable from a handler."""
+    return await asyncio.wrap_future(inference_executor.submit(_infer, session, x))
+
+
+async def get_session(model_id=None):
+    """
+    model_store.get() for async handlers: loading a saved checkpoint reads
+    the file and builds the model, so it runs on the inference executor
+    instead of the event loop.
+    """
+    session = model_store.get(model_id, load=False)
+    if session is None and model_id is not None:
+        session = await asyncio.wrap_future(inference_executor.submit(model_store.get, model_id))
+    return session
+
+
+from fastapi.staticfiles import StaticFiles
+BASE_DIR = Path(__file__).resolve().parent
+
+app.mount("/public", StaticFiles(directory=BASE_DIR / "public"), name="public")
+
+
+@app.post("/train")
+async def train_manual(graph: GraphRequest):
+    # Trains on the short-job lane, not in the HTTP threadpool and not
+    # behind queued /train_dataset jobs.
+    try:
+        job = short_jobs.submit(partial(run_train_manual, graph), kind="train", priority=graph.priority or 0)
+    except RuntimeError as e:
+        return {"error": str(e)}
+    return await asyncio.wrap_future(job.future)
+
+
+def run_train_manual(graph: GraphRequest, job=None):
+    samples = graph.training
+    num_epochs = graph.epochs or 20
+    lr = graph.learningRate or 0.01
+
+    def extract_tensor(d):
+        return torch.tensor(d["data"], dtype=torch.float32).view(1,-1)
+    
+    x = torch.cat([extract_tensor(s.input["data"]) for s in samples], dim=0)
+    y = torch.cat([extract_tensor(s.output["data"]) for s in samples], dim=0)
+
+    try:
+        sorted_graph, model = build_graph(graph)
+        model.output_shapes(x.shape)
+    except Exception as e:
+        return {"error": f"Graph build failed: {e}"}
+
+    #optimizer = torch.optim.SGD(params, lr=lr)
+    optimizer = torch.optim.Adam(model.parameters(), lr=lr)
+
+
+    loss_history = []
+
+    clean_loss_history = []
+
+    for epochs in range(num_epochs):
+        optimizer.zero_grad()
+        z = model(x)
+
+        z = z.view(-1, 1)
+        y = y.view(-1, 1)
+
+        loss = torch.mean((z-y)*(z-y))
+        loss.backward()
+        optimizer.step()
+        loss_history.append(float(loss.item()))
+
+    model.eval()
+
+    with torch.no_grad():
+        out = model(x)
+
+    out = torch.nan_to_num(out, nan=0.0, posinf=1e6, neginf=-1e6)
+
+    for l in loss_history:
+        if math.isfinite(l):
+            clean_loss_history.append(l)
+        else:
+            clean_loss_history.append(None)
+
+    
+    #plt.plot(clean_loss_history)
+    #plt.xlabel("Epoch")
+    #plt.ylabel("Loss")
+    #plt.title("BlockBuild – Loss History")
+    #plt.savefig("loss.png")
+    #plt.close()
+
+    session = ModelSession(graph.model_id or new_model_id(), model, sorted_graph, clean_loss_history)
+    model_store.add(session)
+
+    return {
+        "model_id": session.model_id,
+        "output": out.tolist(),
+        "loss": clean_loss_history[-1],
+        #"loss": loss,
+        #"loss_history": loss_history,
+        "loss_history": clean_loss_history,
+    }
+
+LOG_INTERVAL = int(os.environ.get("BLOCKBUILD_LOG_INTERVAL", 50))
+
+
+class FitResult(NamedTuple):
+    model: nn.Module
+    sorted_graph: SortedGraph
+    loss_history: list
+    backend: str
+    compile_seconds: float
+    backend_error: Optional[str]
+
+
+def fit_dataset(graph: GraphRequest, train_loader, job=None):
+    """
+    Train a fresh model for `graph` on train_loader. Returns (FitResult,
+    None), or (None, error response) when the graph does not build.
+    """
+    num_epochs = graph.epochs or 5
+    lr = graph.learningRate or 0.001
+    batch_size = graph.batchSize or 64
+
+    try:
+        sorted_graph, model = build_graph(graph)
+        model.set_execution(graph.precision, graph.channelsLast)
+        sample_shape = tuple(train_loader.dataset[0][0].shape)
+        model.output_shapes((batch_size,) + sample_shape)
+    except Exception as e:
+        return None, {"error": f"Graph build failed: {e}"}
+
+    example = torch.randn((batch_size,) + sample_shape)
+    runner, backend, compile_seconds, backend_error = compile_for_training(
+        graph, model, example, graph.backend or TRAIN_BACKEND
+    )
+
+    optimizer = torch.optim.SGD(runner.parameters(), lr=lr)
+
+    loss_history = []
     accuracy_history = []
 
     criterion = nn.CrossEntropyLoss()
+
+    # Loss and correct counts stay on-device as tensors and are only read
+    # back every log_interval batches and at the end of each epoch.
+    log_interval = graph.logInterval or LOG_INTERVAL
+    track_accuracy = graph.trainAccuracy is not False
+    num_batches = len(train_loader)
     
     for epoch in range(num_epochs):
-        epoch_loss = 0
-        correct = 0
+        loss_sum = torch.zeros(())
+        correct = torch.zeros((), dtype=torch.long)
         total = 0
 
-        for images, labels in train_loader:
+        for batch, (images, labels) in enumerate(train_loader):
 
             #images = add_noise(images, config.noise_level)
             
-            outputs = forward_once(images)
+            outputs = runner(images)
             loss = criterion(outputs, labels)
 
             optimizer.zero_grad()
             loss.backward()
             optimizer.step()
             
-            #accuracy
-            preds = torch.argmax(outputs, dim = 1)
-            correct += (preds == labels).sum().item()
+            loss_sum += loss.detach()
             total += labels.size(0)
-
-
-            epoch_loss += loss.item()
-
-        epoch_loss /= len(train_loader)  
-        epoch_acc = correct / total
+            if track_accuracy:
+                correct += (outputs.detach().argmax(dim = 1) == labels).sum()
+
+            if job is not None:
+                if (batch + 1) % log_interval == 0:
+                    job.report(
+                        epoch=epoch + 1, epochs=num_epochs,
+                        batch=batch + 1, batches=num_batches,
+                        loss=loss_sum.item() / (batch + 1),
+                        accuracy=correct.item() / total if track_accuracy else None,
+                    )
+                else:
+                    job.report(epoch=epoch + 1, epochs=num_epochs, batch=batch + 1, batches=num_batches)
+
+        epoch_loss = loss_sum.item() / num_batches
+        epoch_acc = correct.item() / total if track_accuracy else None
 
         loss_history.append(epoch_loss)
         accuracy_history.append(epoch_acc)
 
-    for layer in layers.values():
-        if layer is not None:
-            layer.eval()
+        if job is not None:
+            job.log_epoch(epoch=epoch + 1, epochs=num_epochs, loss=epoch_loss, accuracy=epoch_acc)
 
-    correct = 0
-    total = 0
-
-    samples = []
-
-    max_samples = 20
-
-    label_map = None
-
-    if dataset_name == "tinyimagenet":
-        label_map = get_tinyimagenet_maps()
+    if backend == "trace":
+        model.load_state_dict(runner.state_dict())
 
-    elif hasattr(train_loader.dataset, "classes"):
-        label_map = train_loader.dataset.classes
+    return FitResult(model, sorted_graph, loss_history, backend, compile_seconds, backend_error), None
 
 
-    with torch.no_grad():
-        for x, y in train_loader:
-            #x = x.view(x.size(0), -1)
-            out = forward_once(x)
-
-            preds = torch.argmax(out, dim = 1)
-            correct += (preds == y).sum().item()
-            total += y.size(0)
-            
-            # Show small sample
-            for i in range(x.size(0)):
-                #if len(samples) >= max_samples:
-                #    break
-                
-                if preds[i] != y[i]:
-                    true_label = int(y[i])
-                    pred_label = int(preds[i])
-                    
-                    if label_map is not None:
-                        true_label = label_map[true_label]
-                        pred_label = label_map[pred_label]
-
-                    samples.append({
-                        "true": true_label,
-                        "pred": pred_label,
-                        "output": out[i].tolist(),
-                    })
-
-                if len(samples) >= max_samples:
-                    break
+def run_train_dataset(graph: GraphRequest, job=None):
+    batch_size = graph.batchSize or 64
+    dataset_name = graph.datasetName or "mnist"
+    train_loader, test_loader = load_dataset(
+        dataset_name, batch_size, loader=loader_config(graph), eval_batch_size=EVAL_BATCH_SIZE
+    )
 
-    accuracy = correct / total if total > 0 else 0.0
+    if training_processes is not None:
+        fit, error = fit_in_worker_process(graph, train_loader, job)
+    else:
+        fit, error = fit_dataset(graph, train_loader, job)
+    if error is not None:
+        return error
+
+    model, sorted_graph = fit.model, fit.sorted_graph
+    model.eval()
+
+    # Accuracy is measured on the held-out split, optionally on a
+    # stratified subsample of it.
+    test_ds = test_loader.dataset
+    eval_split = getattr(test_ds, "split", None) or "test"
+    eval_samples = graph.evalSamples
+    if eval_split == "train" and eval_samples is None and graph.evalFraction is None:
+        eval_samples = TRAIN_SPLIT_EVAL_SAMPLES
+    indices = eval_indices(test_ds.targets, eval_samples, graph.evalFraction)
+    eval_loader = subset_loader(test_loader, indices, loader_config(graph))
+    label_map = dataset_label_map(dataset_name, test_ds)
 
-    for l in loss_history:
+    clean_loss_history = []
+    for l in fit.loss_history:
         if math.isfinite(l):
             clean_loss_history.append(l)
         else:
@@ -988,32 +2494,251 @@ def train_dataset(graph: GraphRequest):
     #plt.savefig("loss.png")
     #plt.close()
 
-    plot_loss_history.clear()
-    plot_loss_history.extend(clean_loss_history)
-
+    session = ModelSession(graph.model_id or new_model_id(), model, sorted_graph, clean_loss_history)
+    model_store.add(session)
 
-
-    return {
-        "accuracy": accuracy,
-        "correct": correct,
-        "total": total,
-        #"output": out.tolist(),
+    result = {
+        "model_id": session.model_id,
         "loss": clean_loss_history[-1],
         "loss_history": clean_loss_history,
-        "samples": samples,
+        "eval_split": eval_split,
+        "backend": fit.backend,
+        "compile_seconds": fit.compile_seconds,
     }
+    if fit.backend_error is not None:
+        result["backend_error"] = fit.backend_error
+
+    run_eval = lambda job=None: evaluate(session.forward, eval_loader, label_map)
+    eval_job = None
+    if graph.asyncEval:
+        # Evaluation runs as its own job; poll /jobs/{eval_job_id} for it.
+        # A full queue falls back to evaluating inline.
+        try:
+            eval_job = training_jobs.submit(run_eval, kind="evaluate", priority=graph.priority or 0)
+        except RuntimeError:
+            pass
+
+    if eval_job is not None:
+        result.update(accuracy=None, eval_job_id=eval_job.job_id)
+    else:
+        result.update(run_eval())
+
+    return result
 
 
-@app.post("/run")
-def run_single(data: dict):
+@app.post("/train_dataset")
+async def train_dataset(graph: GraphRequest):
+    # Runs on the training pool; awaiting here keeps the HTTP threadpool free.
+    try:
+        job = training_jobs.submit(partial(run_train_dataset, graph), kind="train_dataset", priority=graph.priority or 0)
+    except RuntimeError as e:
+        return {"error": str(e)}
+    return await asyncio.wrap_future(job.future)
+
+
+@app.post("/jobs")
+def submit_job(graph: GraphRequest):
+    if graph.inputSource == "dataset":
+        fn, kind = partial(run_train_dataset, graph), "train_dataset"
+    else:
+        fn, kind = partial(run_train_manual, graph), "train"
+    try:
+        job = training_jobs.submit(fn, kind=kind, priority=graph.priority or 0)
+    except RuntimeError as e:
+        return {"error": str(e)}
+    return job.summary()
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = training_jobs.get(job_id)
+    if job is None:
+        return {"error": f"Unknown job: {job_id}"}
+    return job.summary(include_result=True)
+
+
+
+@app.post("/models/{model_id}/save")
+def save_model(model_id: str):
+    session = model_store.get(model_id)
+    if session is None:
+        return {"error": "Model not trained"}
+    try:
+        path, nbytes = save_checkpoint(session)
+    except (OSError, ValueError) as e:
+        return {"error": str(e)}
+    return {"model_id": model_id, "path": str(path), "bytes": nbytes}
+
+
+@app.post("/models/{model_id}/load")
+def load_model(model_id: str):
+    # Reloads from disk even if the model is already in memory.
+    try:
+        session = load_checkpoint(model_id)
+    except (OSError, ValueError) as e:
+        return {"error": str(e)}
+    if session is None:
+        return {"error": f"No saved model: {model_id}"}
+    model_store.add(session)
+    return {"model_id": model_id, "bytes": session.nbytes, "loss_history": session.loss_history}
+
+
+WS_MAX_RATE = float(os.environ.get("BLOCKBUILD_WS_MAX_RATE", 10))
 
-    global layers, sorted_nodes, graph_edges
-    try: 
-        sorted_nodes=topological_sort(graph_nodes, graph_edges) 
+
+@app.websocket("/ws/train/{job_id}")
+async def train_progress(websocket: WebSocket, job_id: str, rate: float = WS_MAX_RATE):
+    """
+    Streams a training job's progress. Batch updates are coalesced to the
+    latest one and sent at most `rate` times per second; every epoch
+    summary and the final result are always delivered.
+    """
+    await websocket.accept()
+
+    job = training_jobs.get(job_id)
+    if job is None:
+        await websocket.send_json({"type": "error", "error": f"Unknown job: {job_id}"})
+        await websocket.close()
+        return
+
+    interval = 1.0 / min(max(rate, 0.1), WS_MAX_RATE)
+    sent_version = 0
+    sent_epochs = 0
+
+    try:
+        while True:
+            finished = job.finished is not None
+            version = job.version
+            if version != sent_version:
+                for summary in job.epochs[sent_epochs:]:
+                    await websocket.send_json({"type": "epoch", **summary})
+                    sent_epochs += 1
+                if job.progress:
+                    await websocket.send_json({"type": "batch", **job.progress})
+                sent_version = version
+
+            if finished:
+                await websocket.send_json({"type": job.status, **job.summary(include_result=True)})
+                break
+
+            await asyncio.sleep(interval)
+    except WebSocketDisconnect:
+        return
+
+    await websocket.close()
+
+
+# ---- binary tensor I/O ----
+#
+# Request bodies are either raw little-endian buffers described by X-Shape
+# ("4,1,28,28") and X-Dtype ("float32" or "uint8", scaled to [0, 1]), or a
+# .npy file sent as application/x-npy. Both are wrapped without copying.
+# Responses are .npy when the client accepts application/x-npy, otherwise
+# raw float32 with X-Shape / X-Dtype headers.
+
+NPY_MEDIA_TYPE = "application/x-npy"
+BINARY_DTYPES = {"float32": torch.float32, "uint8": torch.uint8}
+
+
+def _frombuffer(body, dtype, count=-1, offset=0):
+    with warnings.catch_warnings():
+        # Request bodies are read-only bytes; the tensor is never written to.
+        warnings.simplefilter("ignore", UserWarning)
+        return torch.frombuffer(body, dtype=dtype, count=count, offset=offset)
+
+
+def _parse_npy(body):
+    stream = io.BytesIO(body)
+    version = np.lib.format.read_magic(stream)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(stream)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(stream)
+    if fortran_order:
+        raise ValueError("Fortran-ordered arrays are not supported")
+    if dtype.str not in ("<f4", "|u1"):
+        raise ValueError(f"Unsupported dtype: {dtype}")
+    count = math.prod(shape)
+    tensor = _frombuffer(body, BINARY_DTYPES[dtype.name], count, stream.tell())
+    return tensor.view(shape)
+
+
+def decode_tensor(body, headers):
+    """Float32 tensor from a binary request body, see above for the formats."""
+    if headers.get("content-type", "").split(";")[0].strip() == NPY_MEDIA_TYPE:
+        x = _parse_npy(body)
+    else:
+        dtype = headers.get("x-dtype", "float32")
+        if dtype not in BINARY_DTYPES:
+            raise ValueError(f"Unsupported dtype: {dtype}")
+        x = _frombuffer(body, BINARY_DTYPES[dtype])
+        shape = headers.get("x-shape")
+        x = x.view([int(d) for d in shape.split(",")]) if shape else x.view(1, -1)
+    if x.dtype == torch.uint8:
+        return x.float().div_(255)
+    return x
+
+
+def encode_tensor(t, headers):
+    array = t.detach().cpu().contiguous().numpy()
+    if NPY_MEDIA_TYPE in headers.get("accept", ""):
+        buffer = io.BytesIO()
+        np.save(buffer, array, allow_pickle=False)
+        return Response(buffer.getvalue(), media_type=NPY_MEDIA_TYPE)
+    return Response(
+        array.tobytes(),
+        media_type="application/octet-stream",
+        headers={"X-Shape": ",".join(map(str, array.shape)), "X-Dtype": array.dtype.name},
+    )
+
+
+async def _binary_input(request):
+    body = await request.body()
+    try:
+        return decode_tensor(body, request.headers), None
     except Exception as e:
-        return {"error": f"Topological sort failed: {e}"}
-    
-    if not layers:
+        return None, {"error": f"Invalid binary input: {e}"}
+
+
+@app.post("/run_binary")
+async def run_binary(request: Request, model_id: Optional[str] = None):
+    x, error = await _binary_input(request)
+    if error is not None:
+        return error
+
+    session = await get_session(model_id)
+    if session is None:
+        return {"error": "Model not trained"}
+
+    out = await run_inference(session, x)
+    return encode_tensor(out, request.headers)
+
+
+@app.post("/predict_binary")
+async def predict_binary(request: Request, model_id: Optional[str] = None, output: Literal["logits", "pred"] = "logits"):
+    x, error = await _binary_input(request)
+    if error is not None:
+        return error
+    if x.dim() != 4:
+        if x.numel() == 0 or x.numel() % (28 * 28):
+            return {"error": f"Invalid binary input: {x.numel()} values are not whole 28x28 images"}
+        x = x.reshape(-1, 1, 28, 28)
+
+    session = await get_session(model_id)
+    if session is None:
+        return {"error": "No model loaded / empty graph"}
+
+    out = await run_inference(session, x)
+    if output == "pred":
+        out = torch.argmax(out, dim = 1)
+    return encode_tensor(out, request.headers)
+
+
+@app.post("/run")
+async def run_single(data: dict):
+
+    session = await get_session(data.get("model_id"))
+    if session is None:
         return {"error": "Model not trained"}
 
     inp = data.get("input")
@@ -1040,8 +2765,7 @@ def run_single(data: dict):
     if x.dim() == 1:
         x = x.unsqueeze(0)
 
-    with torch.no_grad():
-        out = forward_once(x)
+    out = await run_inference(session, x)
 
     #output_list = out.cpu().numpy().tolist()
     #output_list = out.cpu().numpy().tolist()
@@ -1053,100 +2777,177 @@ def run_single(data: dict):
 
 
 @app.post("/test_dataset")
-def test_dataset(config: TestConfig):
-
-    train_loader, test_loader = load_dataset(config.datasetName, config.max_samples)
-
-    for layer in layers.values():
-        if layer is not None:
-            layer.eval()
-
-    correct = 0
-    total = 0
-    samples = []
+async def test_dataset(config: TestConfig):
+    # Full-split evaluation is batch work; it runs on the short-job lane
+    # instead of the inference executor or behind dataset training.
+    try:
+        job = short_jobs.submit(lambda job: run_test_dataset(config), kind="test_dataset")
+    except RuntimeError as e:
+        return {"error": str(e)}
+    return await asyncio.wrap_future(job.future)
 
-    label_map = None
-    if train_loader.dataset == "tinyimagenet":
-        label_map = get_tinyimagenet_maps()
-    elif hasattr(train_loader.dataset, "classes"):
-        label_map = train_loader.dataset.classes
 
-    with torch.no_grad():
-        for x, y in test_loader:
-            #x = x.view(x.size(0), -1)
+def run_test_dataset(config: TestConfig):
+    session = model_store.get(config.model_id)
+    if session is None:
+        return {"error": "Model not trained"}
 
-            x = add_noise(x, config.noise_level)
+    # Evaluation batches are sized for throughput, independent of how many
+    # misclassified samples are returned.
+    test_loader = load_split(config.datasetName, "test", config.eval_batch_size or EVAL_BATCH_SIZE)
+    test_ds = test_loader.dataset
 
-            out = forward_once(x)
-
-            preds = torch.argmax(out, dim = 1)
-            correct += (preds == y).sum().item()
-            total += y.size(0)
-            
-            # Show small sample
-            for i in range(x.size(0)):
-                #if len(samples) >= max_samples:
-                #    break
-                
-
-                if preds[i] != y[i]:
-                    true_label = int(y[i])
-                    pred_label = int(preds[i])
-                    
-                    if label_map is not None:
-                        true_label = label_map[true_label]
-                        pred_label = label_map[pred_label]
-
-                    samples.append({
-                        "true": true_label,
-                        "pred": pred_label,
-                        "output": out[i].tolist(),
-                    })
-
-                if len(samples) >= config.max_samples:
-                    break
+    indices = None
+    if config.limit is not None and config.limit < len(test_ds):
+        indices = torch.arange(max(config.limit, 0))
+    test_loader = subset_loader(test_loader, indices, loader_config())
+    label_map = dataset_label_map(config.datasetName, test_ds)
 
+    forward = lambda x: session.forward(add_noise(x, config.noise_level))
+    return evaluate(forward, test_loader, label_map, config.max_samples)
 
+class MicroBatcher:
+    """
+    Coalesces concurrent single-input forwards: requests arriving within
+    max_wait seconds of the first one, up to max_batch, are stacked and run
+    as one forward pass per model. submit() returns a Future of the row.
+    """
 
-            if len(samples) >= config.max_samples:
+    def __init__(self, max_batch=32, max_wait=0.002):
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = queue.Queue()
+        self.requests = 0
+        self.batches = 0
+        self.largest = 0
+        self.worker = threading.Thread(target=self._work, name="predict-batcher", daemon=True)
+        self.lock = threading.Lock()
+
+    def submit(self, session, x):
+        # Started on first use rather than at import, like JobQueue.
+        if not self.worker.is_alive():
+            with self.lock:
+                if not self.worker.is_alive():
+                    self.worker.start()
+        future = Future()
+        self.queue.put((session, x, future))
+        return future
+
+    def _collect(self):
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            # Whatever queued up during the previous forward goes first.
+            try:
+                batch.append(self.queue.get_nowait())
+                continue
+            except queue.Empty:
+                pass
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
                 break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _work(self):
+        while True:
+            batch = self._collect()
+            self.requests += len(batch)
+            self.batches += 1
+            self.largest = max(self.largest, len(batch))
+
+            groups = OrderedDict()
+            for session, x, future in batch:
+                groups.setdefault(id(session), (session, []))[1].append((x, future))
+
+            for session, items in groups.values():
+                try:
+                    out = _infer(session, torch.cat([x for x, _ in items]))
+                except Exception as e:
+                    for _, future in items:
+                        future.set_exception(e)
+                    continue
+                for row, (_, future) in zip(out.split(1), items):
+                    future.set_result(row)
+
+    def stats(self):
+        return {
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait * 1000,
+            "requests": self.requests,
+            "batches": self.batches,
+            "mean_batch": self.requests / self.batches if self.batches else None,
+            "largest_batch": self.largest,
+        }
 
 
-    accuracy = correct / total if total > 0 else 0.0
+predict_batcher = MicroBatcher(
+    max_batch=int(os.environ.get("BLOCKBUILD_PREDICT_MAX_BATCH", 32)),
+    max_wait=float(os.environ.get("BLOCKBUILD_PREDICT_MAX_WAIT_MS", 2)) / 1000,
+)
 
-    return {
-        "accuracy": accuracy,
-        "correct": correct,
-        "total": total,
-        "samples": samples
-    }
 
 @app.post("/predict")
-def predict(data: dict):
+async def predict(data: dict):
     #return {"prediction": 7}
-    image = np.array(data["image"])
+    image = np.array(data["image"], dtype=np.float32)
     image = image.reshape(1, 1, 28, 28)
     #image = image.reshape(1, -1)
-    tensor = torch.tensor(image).float()
-
-    for layer in layers.values():
-        if layer is not None:
-            layer.eval()
-
-    with torch.no_grad():
-        out = forward_once(tensor)
-        pred = torch.argmax(out, dim = 1).item()
+    tensor = torch.from_numpy(image)
 
-    print("OUT:", out)
-
-    if not sorted_nodes:
+    session = await get_session(data.get("model_id"))
+    if session is None:
         return {
             "error": "No model loaded / empty graph"
         }
 
+    # Concurrent /predict calls share one forward pass through the batcher,
+    # unless the graph mixes samples (matmul, mask): coalesced, each caller
+    # would get a result that depends on the others' images.
+    if getattr(session.model, "batch_independent", True):
+        out = await asyncio.wrap_future(predict_batcher.submit(session, tensor))
+    else:
+        out = await run_inference(session, tensor)
+    pred = torch.argmax(out, dim = 1).item()
+
     return{
         "prediction": pred,
         "output": out[0].tolist(),
     }
 
 
+@app.post("/predict_batch")
+async def predict_batch(data: dict):
+    try:
+        images = np.asarray(data["images"], dtype=np.float32).reshape(-1, 1, 28, 28)
+    except Exception:
+        return {"error": "Invalid input format"}
+
+    session = await get_session(data.get("model_id"))
+    if session is None:
+        return {
+            "error": "No model loaded / empty graph"
+        }
+
+    out = await run_inference(session, torch.from_numpy(images))
+
+    return {
+        "predictions": torch.argmax(out, dim = 1).tolist(),
+        "outputs": out.tolist(),
+    }
+
+
+# Fork the training processes last, so they start with every definition
+# above. Nothing above starts a thread at import (the job queues, the
+# predict batcher and the executors all start theirs on first use), so
+# this process is still single-threaded here and no lock can be left
+# held in the children.
+if TRAIN_PROCESSES > 0:
+    _fork = torch_mp.get_context("fork")
+    _progress_queue = _fork.SimpleQueue()
+    training_processes = ProcessPoolExecutor(TRAIN_PROCESSES, mp_context=_fork, initializer=_init_train_process)
+    training_processes.submit(int).result()
+    threading.Thread(target=_relay_progress, name="train-progress", daemon=True).start()
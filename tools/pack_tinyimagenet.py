@@ -0,0 +1,83 @@
+"""
+Pack Tiny ImageNet into memory-mappable arrays for the server.
+
+Decodes every JPEG once and writes, under <root>/packed:
+
+    train_images.npy  uint8 [N, 64, 64, 3]
+    train_labels.npy  int64 [N]
+    val_images.npy    uint8 [M, 64, 64, 3]   (when <root>/val exists)
+    val_labels.npy    int64 [M]
+    classes.json      wnids in label order (same order as ImageFolder)
+
+    python tools/pack_tinyimagenet.py [--root ./data/tiny-imagenet-200]
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+from PIL import Image
+
+SIZE = 64
+
+
+def _write(path_prefix, files, labels):
+    images = np.lib.format.open_memmap(
+        path_prefix + "_images.npy", mode="w+", dtype=np.uint8, shape=(len(files), SIZE, SIZE, 3)
+    )
+    for i, path in enumerate(files):
+        with Image.open(path) as img:
+            img = img.convert("RGB")
+            if img.size != (SIZE, SIZE):
+                img = img.resize((SIZE, SIZE))
+            images[i] = np.asarray(img)
+    images.flush()
+    del images
+    np.save(path_prefix + "_labels.npy", np.asarray(labels, dtype=np.int64))
+
+
+def pack(root):
+    train_dir = os.path.join(root, "train")
+    out = os.path.join(root, "packed")
+    os.makedirs(out, exist_ok=True)
+
+    classes = sorted(d.name for d in os.scandir(train_dir) if d.is_dir())
+    class_to_idx = {wnid: i for i, wnid in enumerate(classes)}
+
+    files, labels = [], []
+    for wnid in classes:
+        for dirpath, _, names in os.walk(os.path.join(train_dir, wnid)):
+            for name in sorted(names):
+                if name.lower().endswith((".jpeg", ".jpg", ".png")):
+                    files.append(os.path.join(dirpath, name))
+                    labels.append(class_to_idx[wnid])
+    _write(os.path.join(out, "train"), files, labels)
+    counts = {"train": len(files)}
+
+    annotations = os.path.join(root, "val", "val_annotations.txt")
+    if os.path.exists(annotations):
+        files, labels = [], []
+        with open(annotations) as f:
+            for line in f:
+                name, wnid = line.split("\t")[:2]
+                files.append(os.path.join(root, "val", "images", name))
+                labels.append(class_to_idx[wnid])
+        _write(os.path.join(out, "val"), files, labels)
+        counts["val"] = len(files)
+
+    with open(os.path.join(out, "classes.json"), "w") as f:
+        json.dump(classes, f)
+
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--root", default="./data/tiny-imagenet-200")
+    args = parser.parse_args()
+    counts = pack(args.root)
+    print(", ".join(f"{split}: {n} images" for split, n in counts.items()))
+
+
+if __name__ == "__main__":
+    main()